@@ -1,10 +1,29 @@
+import argparse
+import fnmatch
+import hashlib
+import json
 import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
 
 HEADER_TEXT = """Copyright (C) 2025 ABDEL KADER CHATAR
 SocialConnect est un logiciel libre : vous pouvez le redistribuer et/ou le modifier selon les termes de la Licence Publique Générale GNU telle que publiée par la Free Software Foundation, soit la version 3 de la licence, soit (à votre convenance) toute version ultérieure.
 
 Ce programme est distribué dans l'espoir qu'il sera utile, mais SANS AUCUNE GARANTIE ; sans même la garantie implicite de COMMERCIALISATION ou d'ADÉQUATION À UN USAGE PARTICULIER. Voir la Licence Publique Générale GNU pour plus de détails."""
 
+HEADER_MARKER = "Copyright (C) 2025 ABDEL KADER CHATAR"
+# The header sits at the top of the file (after a shebang at most): no need to read further
+HEAD_BYTES = 4096
+
+SOURCE_EXTENSIONS = ('.ts', '.tsx', '.js', '.jsx', '.mjs', '.css', '.py', '.sh')
+# .prisma files only get a header in these places
+PRISMA_DIRS = ('src', 'scripts')
+PRISMA_FILES = ('prisma/schema.prisma',)
+
+# Always skipped, whatever .gitignore says
+DEFAULT_EXCLUDES = ['.git/', 'node_modules/', '.next/', 'dist/']
+INDEX_FILE = '.license_headers_index.json'
+
 def get_commented_header(file_path):
     ext = os.path.splitext(file_path)[1]
 
@@ -20,81 +39,188 @@ def get_commented_header(file_path):
         return "\n".join(commented_lines) + "\n\n"
     return None
 
-def add_header(file_path):
+class IgnoreRules:
+    """Subset of .gitignore semantics: comments, negation (!), directory-only patterns (trailing /),
+    anchored patterns (leading or inner /) and basename patterns matched at any depth.
+    The last matching pattern wins, as in git."""
+
+    def __init__(self, patterns):
+        self.rules = []
+        for line in patterns:
+            line = line.rstrip('\n').rstrip()
+            if not line or line.startswith('#'):
+                continue
+            negate = line.startswith('!')
+            if negate:
+                line = line[1:]
+            dir_only = line.endswith('/')
+            line = line.strip('/') if dir_only else line
+            anchored = line.startswith('/') or '/' in line
+            self.rules.append((line.lstrip('/'), negate, dir_only, anchored))
+
+    @classmethod
+    def from_files(cls, paths, extra_patterns=()):
+        patterns = list(DEFAULT_EXCLUDES)
+        for path in paths:
+            if os.path.exists(path):
+                with open(path, 'r', encoding='utf-8') as f:
+                    patterns.extend(f.readlines())
+        patterns.extend(extra_patterns)
+        return cls(patterns)
+
+    def ignored(self, rel_path, is_dir):
+        name = rel_path.rsplit('/', 1)[-1]
+        result = False
+        for pattern, negate, dir_only, anchored in self.rules:
+            if dir_only and not is_dir:
+                continue
+            target = rel_path if anchored else name
+            if fnmatch.fnmatchcase(target, pattern) or (anchored and fnmatch.fnmatchcase(target, pattern + '/**')):
+                result = not negate
+        return result
+
+def is_candidate(rel_path):
+    if rel_path.endswith(SOURCE_EXTENSIONS):
+        return True
+    if rel_path.endswith('.prisma'):
+        return rel_path in PRISMA_FILES or rel_path.split('/', 1)[0] in PRISMA_DIRS
+    return False
+
+def iter_candidate_files(base_dir, rules):
+    """Single walk of the tree, pruning ignored directories before descending into them."""
+    for root, dirs, files in os.walk(base_dir):
+        rel_root = os.path.relpath(root, base_dir).replace(os.sep, '/')
+        rel_root = '' if rel_root == '.' else rel_root + '/'
+        dirs[:] = [d for d in dirs if not rules.ignored(rel_root + d, is_dir=True)]
+        for file in files:
+            rel_path = rel_root + file
+            if is_candidate(rel_path) and not rules.ignored(rel_path, is_dir=False):
+                yield rel_path
+
+def has_header(file_path):
+    """Looks for the copyright marker in the first HEAD_BYTES bytes only."""
+    with open(file_path, 'rb') as f:
+        head = f.read(HEAD_BYTES)
+    return HEADER_MARKER in head.decode('utf-8', errors='ignore')
+
+def add_header(file_path, dry_run=False):
+    """Prepends the header; returns True when the file was (or, in dry-run, would be) changed."""
     header = get_commented_header(file_path)
     if not header:
-        return
-
-    try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            content = f.read()
-
-        if "Copyright (C) 2025 ABDEL KADER CHATAR" in content:
-            print(f"Skipping {file_path}, header already present.")
-            return
-
-        # Preserve shebang for shell scripts
-        if file_path.endswith('.sh') and content.startswith('#!'):
-            lines = content.split('\n')
-            new_content = lines[0] + '\n\n' + header + '\n'.join(lines[1:])
-        else:
-            new_content = header + content
+        return False
 
-        with open(file_path, 'w', encoding='utf-8') as f:
-            f.write(new_content)
-        print(f"Added header to {file_path}")
+    with open(file_path, 'r', encoding='utf-8') as f:
+        content = f.read()
 
-    except Exception as e:
-        print(f"Error processing {file_path}: {e}")
+    if HEADER_MARKER in content:
+        return False
+    if dry_run:
+        return True
 
-def main():
-    base_dir = os.getcwd()
-    target_dirs = ['src', 'scripts']
-    target_files = ['deploy.sh', 'clean-docker.sh', 'commit-helper.sh', 'validate-refactoring.sh', 'setup.sh'] # Add known root scripts
-
-    # Process target directories
-    for d in target_dirs:
-        path = os.path.join(base_dir, d)
-        if not os.path.exists(path):
-            continue
-        for root, dirs, files in os.walk(path):
-            if 'node_modules' in root or '.next' in root:
-                continue
-            for file in files:
-                if file.endswith(('.ts', '.tsx', '.js', '.jsx', '.mjs', '.css', '.py', '.sh', '.prisma')):
-                    add_header(os.path.join(root, file))
+    # Preserve shebang for shell scripts
+    if file_path.endswith('.sh') and content.startswith('#!'):
+        lines = content.split('\n')
+        new_content = lines[0] + '\n\n' + header + '\n'.join(lines[1:])
+    else:
+        new_content = header + content
 
-    # Process specific root files and others
-    for root, dirs, files in os.walk(base_dir):
-        # Skip hidden directories and dependencies
-        if any(part.startswith('.') for part in root.split(os.sep)) and not root.endswith('.connector'): # naive check
-             continue
-        if 'node_modules' in root:
-             continue
-
-        for file in files:
-            # We already did src and scripts recursively, so avoid re-doing them if we traverse from root.
-            # But the logic above specifically targetted src and scripts.
-            # Now let's just do a clean pass over everything and rely on "Skip if header present"
+    with open(file_path, 'w', encoding='utf-8') as f:
+        f.write(new_content)
+    return True
 
-            # Actually, let's just stick to the plan: src, scripts, specific known root files + prisma
-            pass
+def header_fingerprint():
+    return hashlib.sha1(HEADER_TEXT.encode('utf-8')).hexdigest()
 
-    # Explicitly looking for prisma
-    prisma_path = os.path.join(base_dir, 'prisma', 'schema.prisma')
-    if os.path.exists(prisma_path):
-        add_header(prisma_path)
+def load_index(index_path):
+    """Returns {rel_path: [mtime_ns, size]} of files known to carry the current header."""
+    try:
+        with open(index_path, 'r', encoding='utf-8') as f:
+            index = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+    if index.get('header') != header_fingerprint():
+        return {}  # header text changed: everything must be checked again
+    return index.get('files', {})
+
+def save_index(index_path, files):
+    tmp_path = index_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({'header': header_fingerprint(), 'files': files}, f, sort_keys=True)
+    os.replace(tmp_path, index_path)
+
+def process_file(base_dir, rel_path, known, mode):
+    """Thread pool task: returns (rel_path, status, [mtime_ns, size]).
+
+    status is 'cached' (unchanged since a run that saw the header), 'ok', 'missing'
+    (check/dry-run), 'added' or 'error: ...'.
+    """
+    file_path = os.path.join(base_dir, rel_path)
+    try:
+        stat = os.stat(file_path)
+        signature = [stat.st_mtime_ns, stat.st_size]
+        if known == signature:
+            return rel_path, 'cached', signature
+        if has_header(file_path):
+            return rel_path, 'ok', signature
+        # Not in the head: add_header reads the whole file, the marker may sit beyond HEAD_BYTES
+        if not add_header(file_path, dry_run=(mode != 'apply')):
+            return rel_path, 'ok', signature
+        if mode == 'apply':
+            stat = os.stat(file_path)
+            return rel_path, 'added', [stat.st_mtime_ns, stat.st_size]
+        return rel_path, 'missing', signature
+    except (OSError, UnicodeDecodeError) as e:
+        return rel_path, f"error: {e}", None
 
-    # Walk everything for thoroughness but exclude git/node_modules
-    for root, dirs, files in os.walk(base_dir):
-        if '.git' in dirs: dirs.remove('.git')
-        if 'node_modules' in dirs: dirs.remove('node_modules')
-        if '.next' in dirs: dirs.remove('.next')
-        if 'dist' in dirs: dirs.remove('dist')
+def main():
+    parser = argparse.ArgumentParser(description="Add the GPL license header to source files.")
+    parser.add_argument('--check', action='store_true',
+                        help="Only report files without the header; exit code 1 if any (no file is modified)")
+    parser.add_argument('--dry-run', action='store_true', help="List the files that would get the header")
+    parser.add_argument('--exclude', action='append', default=[], metavar='PATTERN',
+                        help=".gitignore-style pattern to skip (repeatable)")
+    parser.add_argument('--no-gitignore', action='store_true', help="Do not read .gitignore")
+    parser.add_argument('--index', default=INDEX_FILE,
+                        help="mtime/size index of files already verified (relative to the repository root)")
+    parser.add_argument('--full', action='store_true', help="Ignore the index and check every file")
+    parser.add_argument('--jobs', type=int, default=min(32, (os.cpu_count() or 1) * 4),
+                        help="Number of scanning threads")
+    args = parser.parse_args()
 
-        for file in files:
-             if file.endswith(('.ts', '.tsx', '.js', '.jsx', '.mjs', '.css', '.py', '.sh')):
-                 add_header(os.path.join(root, file))
+    base_dir = os.getcwd()
+    mode = 'check' if args.check else 'dry-run' if args.dry_run else 'apply'
+    ignore_files = [] if args.no_gitignore else [os.path.join(base_dir, '.gitignore')]
+    rules = IgnoreRules.from_files(ignore_files, args.exclude + ['/' + args.index])
+    index_path = os.path.join(base_dir, args.index)
+    index = {} if args.full else load_index(index_path)
+
+    rel_paths = list(iter_candidate_files(base_dir, rules))
+    with ThreadPoolExecutor(max_workers=args.jobs) as executor:
+        results = list(executor.map(lambda rel_path: process_file(base_dir, rel_path, index.get(rel_path), mode),
+                                    rel_paths))
+
+    counts = {}
+    new_index = {}
+    for rel_path, status, signature in sorted(results):
+        kind = status.split(':', 1)[0]
+        counts[kind] = counts.get(kind, 0) + 1
+        if status in ('cached', 'ok', 'added'):
+            new_index[rel_path] = signature
+        if status == 'added':
+            print(f"Added header to {rel_path}")
+        elif status == 'missing':
+            print(f"{'Missing header' if mode == 'check' else 'Would add header to'}: {rel_path}")
+        elif kind == 'error':
+            print(f"Error processing {rel_path}: {status[len('error: '):]}")
+
+    # The index only lists files known to have the header, so a dry run can update it too;
+    # --check never writes anything (it must also work on a read-only checkout)
+    if mode != 'check':
+        save_index(index_path, new_index)
+    print(f"{len(rel_paths)} files: " + ", ".join(f"{count} {kind}" for kind, count in sorted(counts.items())))
+
+    if mode == 'check' and (counts.get('missing') or counts.get('error')):
+        sys.exit(1)
 
 if __name__ == "__main__":
     main()
@@ -8,15 +8,21 @@ Ce programme est distribué dans l'espoir qu'il sera utile, mais SANS AUCUNE GAR
 import { NextRequest, NextResponse } from 'next/server';
 import { getServiceClient } from '@/lib/prisma-clients';
 import { getDynamicServiceId } from '@/lib/auth-utils';
-import { exec } from 'child_process';
-import { promisify } from 'util';
 import * as fs from 'fs/promises';
+import { createHash } from 'crypto';
 import * as path from 'path';
 import { format } from 'date-fns';
 import { getServerSession } from 'next-auth/next';
 import { authOptions } from '@/lib/authOptions';
+import { runExcelExportJob, ExportFormat } from '@/lib/excelExportWorker';
 
-const execAsync = promisify(exec);
+// Parquet is CLI-only for now (export_users_excel.py --format parquet): the image does not install pyarrow
+type RouteExportFormat = Exclude<ExportFormat, 'parquet'>;
+
+const CONTENT_TYPES: Record<RouteExportFormat, string> = {
+  xlsx: 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+  csv: 'text/csv; charset=utf-8',
+};
 
 export async function GET(request: NextRequest) {
   try {
@@ -31,6 +37,11 @@ export async function GET(request: NextRequest) {
     // Get year filter from query parameters
     const { searchParams } = new URL(request.url);
     const annee = searchParams.get('annee');
+    // Optional column subset (comma-separated headers), e.g. ?columns=Nom,Prénom,Téléphone
+    const columnsParam = searchParams.get('columns');
+    const columns = columnsParam ? columnsParam.split(',').map(c => c.trim()).filter(Boolean) : undefined;
+    // Output format: styled workbook (default), or raw tabular data for reporting (?format=csv)
+    const exportFormat: RouteExportFormat = searchParams.get('format') === 'csv' ? 'csv' : 'xlsx';
 
     // Build where clause
     const where: { annee?: number } = {};
@@ -129,41 +140,52 @@ export async function GET(request: NextRequest) {
     await fs.mkdir(tempDir, { recursive: true });
     const tempJsonFileName = `users_export_${Date.now()}.json`;
     const tempJsonFilePath = path.join(tempDir, tempJsonFileName);
-    await fs.writeFile(tempJsonFilePath, JSON.stringify(cleanedUsers));
-
-    // Define the path to the Python script and the output Excel file
-    const pythonScriptPath = path.join(process.cwd(), 'src', 'export_users_excel.py');
+    const usersJson = JSON.stringify(cleanedUsers);
+    await fs.writeFile(tempJsonFilePath, usersJson);
+    // Cache version key: hash of the payload already in memory, so the worker doesn't re-read the file to key it
+    const cacheKey = createHash('sha256').update(usersJson).digest('hex');
 
+    // Define the output Excel file (generated by the persistent Python export worker)
     const currentDate = format(new Date(), 'yyyy-MM-dd');
-    const outputFileName = `Export_Usagers_${currentDate}_${Date.now()}.xlsx`;
+    const outputFileName = `Export_Usagers_${currentDate}_${Date.now()}.${exportFormat}`;
     const outputFilePath = path.join(tempDir, outputFileName);
 
-    // Execute the Python script, passing the JSON file path and output Excel path as arguments
-    const command = `python3 "${pythonScriptPath}" "${tempJsonFilePath}" "${outputFilePath}"`;
-    console.log(`[API Export] Exécution de la commande: ${command}`);
+    // Send the job to the persistent Python worker (src/export_users_excel.py --worker)
+    console.log(`[API Export] Envoi du job d'export au worker Python: ${outputFilePath}`);
 
     try {
-      const { stdout, stderr } = await execAsync(command);
-      if (stderr) {
-        console.error(`[API Export] Erreur du script Python (stderr): ${stderr}`);
+      const result = await runExcelExportJob({
+        input: tempJsonFilePath,
+        output: outputFilePath,
+        columns,
+        format: exportFormat,
+        cache: true,
+        cache_key: cacheKey,
+        // Opt-in instrumentation (EXPORT_METRICS=1): the JSON summary is logged with the result
+        metrics: process.env.EXPORT_METRICS === '1',
+        // ?diagnostics=1 adds the unparsable values report as a hidden sheet
+        diagnostics_sheet: searchParams.get('diagnostics') === '1',
+      });
+      if (!result.ok) {
+        console.error(`[API Export] Erreur du worker Python: ${result.error}`);
+        return NextResponse.json({
+          error: 'Échec de l\'exécution du script Python.',
+          details: result.error,
+        }, { status: 500 });
       }
-      if (stdout) {
-        console.log(`[API Export] Sortie du script Python (stdout): ${stdout}`);
+      console.log(`[API Export] Export terminé par le worker Python en ${result.duration_ms} ms${result.cache_hit ? ' (cache)' : ''}`);
+      if (result.diagnostics) {
+        const fields = Object.entries(result.diagnostics.by_field).map(([field, entry]) => `${field} (${entry.count})`);
+        console.warn(`[API Export] ${result.diagnostics.total} valeurs illisibles (dates / JSON): ${fields.join(', ')}`);
       }
-    } catch (executionError: unknown) {
-      console.error('[API Export] Échec de l\'exécution de la commande Python:', executionError);
-      // Clean up the temporary JSON file even if Python script fails
-      try {
-        await fs.unlink(tempJsonFilePath);
-      } catch (unlinkError) {
-        console.error(`[API Export] Erreur lors de la suppression du fichier JSON temporaire ${tempJsonFilePath}:`, unlinkError);
+      if (result.metrics) {
+        console.log('[API Export] Métriques du worker Python:', JSON.stringify(result.metrics));
       }
-      const execError = executionError as { message?: string; stderr?: string; stdout?: string };
+    } catch (executionError: unknown) {
+      console.error('[API Export] Échec du worker Python:', executionError);
       return NextResponse.json({
         error: 'Échec de l\'exécution du script Python.',
-        details: execError.message,
-        stderr: execError.stderr,
-        stdout: execError.stdout
+        details: executionError instanceof Error ? executionError.message : String(executionError),
       }, { status: 500 });
     } finally {
       // Clean up the temporary JSON file after successful execution
@@ -196,7 +218,7 @@ export async function GET(request: NextRequest) {
     return new NextResponse(new Uint8Array(fileContent), {
       status: 200,
       headers: {
-        'Content-Type': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+        'Content-Type': CONTENT_TYPES[exportFormat],
         'Content-Disposition': `attachment; filename="${outputFileName}"`,
       },
     });
@@ -4,62 +4,345 @@
 # Ce programme est distribué dans l'espoir qu'il sera utile, mais SANS AUCUNE GARANTIE ; sans même la garantie implicite de COMMERCIALISATION ou d'ADÉQUATION À UN USAGE PARTICULIER. Voir la Licence Publique Générale GNU pour plus de détails.
 
 import sys
+import os
+import re
 import json
+import shutil
+import functools
+import hashlib
+import itertools
+import base64
+import contextlib
+import csv
+import queue
+import socketserver
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+import argparse
+from collections import Counter, OrderedDict, deque
+from datetime import datetime
 import openpyxl
-from openpyxl.styles import Font, Border, Side, PatternFill, Alignment # Ajout de Alignment
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font, Border, Side, PatternFill, Alignment, NamedStyle # Ajout de Alignment
 from openpyxl.utils import get_column_letter
-# dateutil.parser sera importé dans la fonction format_date pour gérer une potentielle ImportError
+try:
+    from dateutil import parser as date_parser
+except ImportError:  # dateutil reste optionnel : le parsing ISO manuel prend le relais
+    date_parser = None
+from instrumentation import DISABLED as NO_INSTRUMENTATION, Instrumentation, process_peak_rss_mb, reset_peak_rss
+
+# Format produit par Prisma / JSON.stringify : YYYY-MM-DDTHH:MM:SS.sssZ (ou simple YYYY-MM-DD)
+# Date ISO seule ou suivie d'une heure complète (ex : 2024-03-05T10:30:00.000Z), jusqu'à la fin de la chaîne ;
+# toute autre suite ("2024-03-05 xyz") passe par le parsing lent, qui la signale dans les diagnostics
+ISO_DATE_PATTERN = re.compile(
+    r"(\d{4})-(\d{2})-(\d{2})"
+    r"(?:[T ]\d{2}:\d{2}(?::\d{2}(?:\.\d+)?)?(?:Z|[+-]\d{2}(?::?\d{2})?)?)?$"
+)
+
+class DateNormalizer:
+    """Normalizes date values to DD/MM/YYYY (European format).
+
+    Paths, from cheapest to most expensive: already formatted, ISO-8601 fast path,
+    bounded LRU cache, dateutil, then manual strptime attempts. Each value increments
+    the counter of the path it took (see `counters`). Problematic string values are
+    remembered in `issues` (value -> kind) instead of being logged one by one; see
+    ExportDiagnostics for the aggregated report. An issue lives as long as the cached
+    result of its value: both are evicted together.
+    """
+
+    def __init__(self, cache_size=4096):
+        self.cache_size = cache_size
+        self.counters = Counter()
+        self.issues = {}
+        self._cache = OrderedDict()
+        self._dateutil_warning_emitted = False
+
+    def format(self, date_str):
+        if not date_str:
+            self.counters['empty'] += 1
+            return ""
+
+        if not isinstance(date_str, str):
+            self.counters['non_string'] += 1
+            return self._parse_slow(date_str)
+
+        cached = self._cache.get(date_str)
+        if cached is not None:
+            self._cache.move_to_end(date_str)
+            self.counters['cache_hit'] += 1
+            return cached
+
+        # Si c'est déjà une chaîne au format DD/MM/YYYY, la retourner telle quelle
+        if len(date_str) == 10 and date_str[2] == '/' and date_str[5] == '/':
+            self.counters['passthrough'] += 1
+            return date_str
+
+        result = self._parse_iso(date_str)
+        if result is not None:
+            self.counters['iso_fast'] += 1
+        else:
+            result = self._parse_slow(date_str)
+
+        self._cache[date_str] = result
+        if len(self._cache) > self.cache_size:
+            evicted, _ = self._cache.popitem(last=False)
+            self.issues.pop(evicted, None)
+        return result
+
+    def _parse_iso(self, date_str):
+        match = ISO_DATE_PATTERN.match(date_str)
+        if not match:
+            return None
+        year, month, day = match.groups()
+        try:
+            # Valide la date (ex: 2025-02-30) avant de la reformater
+            datetime(int(year), int(month), int(day))
+        except ValueError:
+            return None
+        return f"{day}/{month}/{year}"
+
+    def _parse_slow(self, date_str):
+        # Essayer de parser avec dateutil (formats libres)
+        if date_parser is not None:
+            try:
+                date_obj = date_parser.parse(date_str)
+                self.counters['dateutil'] += 1
+                return date_obj.strftime('%d/%m/%Y')  # Format européen
+            except Exception:
+                # Continue vers le parsing manuel ; la valeur est signalée dans le rapport de diagnostic
+                self._record_issue(date_str, 'dateutil_failed')
+        elif not self._dateutil_warning_emitted:
+            self._warn("Warning: dateutil not installed, using manual date parsing\n")
+            self._dateutil_warning_emitted = True
+
+        # Fallback: Parser manuellement le format ISO (YYYY-MM-DDTHH:MM:SS.sssZ)
+        try:
+            if isinstance(date_str, str):
+                # Extraire juste la partie date (YYYY-MM-DD) du format ISO
+                if 'T' in date_str:
+                    date_part = date_str.split('T')[0]
+                    # Valider que c'est bien au format YYYY-MM-DD
+                    if len(date_part) == 10 and date_part[4] == '-' and date_part[7] == '-':
+                        # Convertir YYYY-MM-DD en DD/MM/YYYY
+                        parts = date_part.split('-')
+                        self.counters['manual_iso'] += 1
+                        self._record_issue(date_str, 'manual_fallback')
+                        return f"{parts[2]}/{parts[1]}/{parts[0]}"
+
+                # Essayer plusieurs formats courants
+                for fmt in ['%Y-%m-%dT%H:%M:%S.%fZ', '%Y-%m-%dT%H:%M:%SZ', '%Y-%m-%d %H:%M:%S', '%Y-%m-%d']:
+                    try:
+                        date_obj = datetime.strptime(date_str, fmt)
+                        self.counters['strptime'] += 1
+                        self._record_issue(date_str, 'manual_fallback')
+                        return date_obj.strftime('%d/%m/%Y')  # Format européen
+                    except ValueError:
+                        continue
+        except Exception:
+            pass
+
+        # Dernier recours: retourner une chaîne vide pour éviter des données incorrectes
+        self.counters['failed'] += 1
+        self._record_issue(date_str, 'unparseable' if isinstance(date_str, str) else 'not_a_string')
+        return ""
+
+    def _record_issue(self, date_str, kind):
+        self.counters['warnings'] += 1
+        # Seules les chaînes sont mémorisées : elles seules passent par le cache, qui borne aussi `issues`
+        if isinstance(date_str, str):
+            self.issues[date_str] = kind
+
+    def _warn(self, message):
+        self.counters['warnings'] += 1
+        sys.stderr.write(message)
+
+    def stats(self):
+        """Returns the path counters and the current cache size."""
+        return {**self.counters, 'cache_size': len(self._cache)}
+
+DATE_NORMALIZER = DateNormalizer()
 
 def format_date(date_str):
     """Formats a date string to DD/MM/YYYY (European format) with robust fallback."""
-    if not date_str:
-        return ""
+    return DATE_NORMALIZER.format(date_str)
+
+# Rapport de diagnostic : nombre d'exemples de valeurs et d'ids d'usagers gardés par champ
+DIAGNOSTIC_SAMPLES = 5
+DIAGNOSTIC_MAX_IDS = 200
+DIAGNOSTICS_SHEET_TITLE = "Diagnostics"
+
+class ExportDiagnostics:
+    """Aggregates the date and JSON parsing problems of one export into a single report.
 
-    # Si c'est déjà une chaîne au format DD/MM/YYYY, la retourner telle quelle
-    if isinstance(date_str, str) and len(date_str) == 10 and date_str[2] == '/' and date_str[5] == '/':
-        return date_str
+    Each problem is counted per field and per kind, with a few sample values and the ids of
+    the usagers affected (both bounded), instead of one stderr line per value.
+    """
 
-    # Essayer de parser avec dateutil (format ISO, etc.)
+    def __init__(self, include_sheet=False):
+        self.include_sheet = include_sheet
+        self.by_kind = Counter()
+        self.fields = {}
+
+    @property
+    def total(self):
+        return sum(self.by_kind.values())
+
+    def record(self, field, kind, value, user):
+        entry = self.fields.get(field)
+        if entry is None:
+            entry = self.fields[field] = {'count': 0, 'kinds': Counter(), 'samples': [], 'usager_ids': [],
+                                          'usager_ids_truncated': False}
+        entry['count'] += 1
+        entry['kinds'][kind] += 1
+        self.by_kind[kind] += 1
+        sample = value if isinstance(value, str) else repr(value)
+        if len(entry['samples']) < DIAGNOSTIC_SAMPLES and sample not in entry['samples']:
+            entry['samples'].append(sample)
+        usager_id = user.get('id') or f"{user.get('nom', '')} {user.get('prenom', '')}".strip()
+        if usager_id not in entry['usager_ids']:
+            if len(entry['usager_ids']) < DIAGNOSTIC_MAX_IDS:
+                entry['usager_ids'].append(usager_id)
+            else:
+                entry['usager_ids_truncated'] = True
+
+    def record_date(self, field, value, user):
+        kind = DATE_NORMALIZER.issues.get(value, 'unparseable') if isinstance(value, str) else 'not_a_string'
+        self.record(field, kind, value, user)
+
+    def merge(self, other):
+        """Adds the problems collected by another instance (e.g. in a pool process)."""
+        self.by_kind.update(other.by_kind)
+        for field, other_entry in other.fields.items():
+            entry = self.fields.setdefault(field, {'count': 0, 'kinds': Counter(), 'samples': [], 'usager_ids': [],
+                                                   'usager_ids_truncated': False})
+            entry['count'] += other_entry['count']
+            entry['kinds'].update(other_entry['kinds'])
+            entry['samples'] = (entry['samples'] + [sample for sample in other_entry['samples']
+                                                    if sample not in entry['samples']])[:DIAGNOSTIC_SAMPLES]
+            new_ids = [usager_id for usager_id in other_entry['usager_ids'] if usager_id not in entry['usager_ids']]
+            entry['usager_ids_truncated'] |= other_entry['usager_ids_truncated'] or \
+                len(entry['usager_ids']) + len(new_ids) > DIAGNOSTIC_MAX_IDS
+            entry['usager_ids'] = (entry['usager_ids'] + new_ids)[:DIAGNOSTIC_MAX_IDS]
+
+    def report(self):
+        return {
+            'total': self.total,
+            'by_kind': dict(self.by_kind.most_common()),
+            'by_field': {
+                field: {**entry, 'kinds': dict(entry['kinds'].most_common())}
+                for field, entry in sorted(self.fields.items(), key=lambda item: -item[1]['count'])
+            },
+        }
+
+    def summary_line(self):
+        fields = ", ".join(f"{field} ({entry['count']})" for field, entry in
+                           sorted(self.fields.items(), key=lambda item: -item[1]['count']))
+        return f"Warning: {self.total} date/JSON values could not be parsed cleanly: {fields}\n"
+
+    def write(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.report(), f, ensure_ascii=False, indent=2)
+
+# Diagnostics de l'export en cours (remplacés à chaque create_export, fusionnés depuis le pool de processus)
+DIAGNOSTICS = ExportDiagnostics()
+
+def format_date_field(date_str, field, user):
+    """format_date, reporting the values of field it had trouble with to DIAGNOSTICS."""
+    result = DATE_NORMALIZER.format(date_str)
+    if date_str and (not result or (isinstance(date_str, str) and date_str in DATE_NORMALIZER.issues)):
+        DIAGNOSTICS.record_date(field, date_str, user)
+    return result
+
+# Instrumentation active (--metrics / --profile-out) ; désactivée par défaut, voir instrumented_run
+INSTRUMENTATION = NO_INSTRUMENTATION
+
+@contextlib.contextmanager
+def instrumented_run(instrumentation):
+    """Makes instrumentation the active one during the block and adds the date path counters to it."""
+    global INSTRUMENTATION
+    date_counters_before = Counter(DATE_NORMALIZER.counters)
+    previous, INSTRUMENTATION = INSTRUMENTATION, instrumentation
     try:
-        from dateutil import parser
-        date_obj = parser.parse(date_str)
-        return date_obj.strftime('%d/%m/%Y')  # Format européen
-    except ImportError:
-        # Fallback: parser manuellement le format ISO
-        sys.stderr.write(f"Warning: dateutil not installed, using manual ISO parsing for: {date_str}\n")
-        pass  # Continue vers le parsing manuel
-    except Exception as e:
-        # Log l'erreur mais continue vers le parsing manuel
-        sys.stderr.write(f"Warning: dateutil parsing failed for '{date_str}': {e}\n")
-        pass
-
-    # Fallback: Parser manuellement le format ISO (YYYY-MM-DDTHH:MM:SS.sssZ)
+        with instrumentation:
+            yield instrumentation
+    finally:
+        INSTRUMENTATION = previous
+        for path, count in (DATE_NORMALIZER.counters - date_counters_before).items():
+            instrumentation.count(f"date_{path}", count)
+
+# Taille des blocs lus dans le fichier d'entrée par le lecteur JSON incrémental
+INPUT_CHUNK_SIZE = 64 * 1024
+JSON_SEPARATORS = re.compile(r"[\s,]*")
+
+def read_users_stream(input_json_path, chunk_size=INPUT_CHUNK_SIZE):
+    """Opens a JSON array or NDJSON file of usagers and returns a generator over them.
+
+    Only the current usager (plus one read block) is held in memory. The file format is
+    detected eagerly so that a missing file or a non-list document fails before the export starts.
+    """
+    input_file = open(input_json_path, 'r', encoding='utf-8-sig')
     try:
-        if isinstance(date_str, str):
-            # Extraire juste la partie date (YYYY-MM-DD) du format ISO
-            if 'T' in date_str:
-                date_part = date_str.split('T')[0]
-                # Valider que c'est bien au format YYYY-MM-DD
-                if len(date_part) == 10 and date_part[4] == '-' and date_part[7] == '-':
-                    # Convertir YYYY-MM-DD en DD/MM/YYYY
-                    parts = date_part.split('-')
-                    return f"{parts[2]}/{parts[1]}/{parts[0]}"
-
-            # Essayer de parser avec datetime standard (sans dateutil)
-            from datetime import datetime
-            # Essayer plusieurs formats courants
-            for fmt in ['%Y-%m-%dT%H:%M:%S.%fZ', '%Y-%m-%dT%H:%M:%SZ', '%Y-%m-%d %H:%M:%S', '%Y-%m-%d']:
-                try:
-                    date_obj = datetime.strptime(date_str, fmt)
-                    return date_obj.strftime('%d/%m/%Y')  # Format européen
-                except ValueError:
-                    continue
-    except Exception as e:
-        sys.stderr.write(f"Error: All date parsing methods failed for '{date_str}': {e}\n")
+        head = input_file.read(chunk_size)
+        stripped = head.lstrip()
+        while not stripped and head:
+            head = input_file.read(chunk_size)
+            stripped = head.lstrip()
+    except Exception:
+        input_file.close()
+        raise
+
+    if stripped.startswith('['):
+        return _iter_json_array(input_file, stripped, chunk_size)
+    if stripped.startswith('{'):
+        return _iter_ndjson(input_file, stripped)
+    input_file.close()
+    raise ValueError("Expected a list of users from input JSON file")
 
-    # Dernier recours: retourner une chaîne vide pour éviter des données incorrectes
-    sys.stderr.write(f"Error: Could not parse date '{date_str}', returning empty string\n")
-    return ""
+def _iter_json_array(input_file, buffer, chunk_size):
+    """Yields the objects of a top-level JSON array, decoding one element at a time."""
+    decoder = json.JSONDecoder()
+    pos = 1  # après le '['
+    eof = False
+    try:
+        while True:
+            pos = JSON_SEPARATORS.match(buffer, pos).end()
+            if pos == len(buffer):
+                if eof:
+                    raise json.JSONDecodeError("Unterminated array", buffer, pos)
+                chunk = input_file.read(chunk_size)
+                buffer, pos, eof = buffer[pos:] + chunk, 0, not chunk
+                continue
+            if buffer[pos] == ']':
+                return
+            if buffer[pos] != '{':
+                raise ValueError("Expected a list of users from input JSON file")
+            try:
+                user, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                # Élément incomplet : on double la lecture pour ne pas re-décoder trop souvent un gros usager
+                chunk = input_file.read(max(chunk_size, len(buffer) - pos))
+                buffer, pos, eof = buffer[pos:] + chunk, 0, not chunk
+                continue
+            yield user
+            pos = end
+    finally:
+        input_file.close()
+
+def _iter_ndjson(input_file, head):
+    """Yields one usager per non-empty line (NDJSON)."""
+    try:
+        # Compléter la dernière ligne partielle du bloc déjà lu
+        first_lines = (head + input_file.readline()).splitlines()
+        for line in itertools.chain(first_lines, input_file):
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+    finally:
+        input_file.close()
 
 def get_gestionnaire_name(gestionnaire):
     """Extracts gestionnaire name from object or returns string directly."""
@@ -80,25 +363,312 @@ def get_gestionnaire_name(gestionnaire):
     # Autre type inattendu
     return str(gestionnaire) if gestionnaire else ""
 
-def create_excel_export(users_data, output_path):
-    """Creates an Excel file from user data."""
+# Plafonds de largeur (en caractères) pour les colonnes de texte long
+WRAP_TEXT_WIDTH_CAP = 50
+LONG_TEXT_WIDTH_CAP = 70
+
+class ExportColumn:
+    """Declares one export column: header, how its value is extracted and formatted, style and width cap.
+
+    source tells which object the value is read from: the usager itself, its adresse or its parsed
+    logementDetails. key reads that object's field (missing -> "", or None when a formatter is set);
+    compute(user, adresse, logement) replaces the key lookup for derived values.
+    """
+
+    def __init__(self, header, key=None, source='usager', compute=None, formatter=None, wrap=False, width_cap=None):
+        self.header = header
+        self.key = key
+        self.source = source
+        self.compute = compute
+        self.formatter = formatter
+        self.wrap = wrap
+        self.width_cap = width_cap
+
+    def compile(self):
+        """Returns the extractor function (user, adresse, logement) -> cell value."""
+        if self.compute is not None:
+            return self.compute
+        key, formatter, header = self.key, self.formatter, self.header
+        default = None if formatter else ""
+        if formatter is format_date:
+            # Colonnes de date : les valeurs problématiques sont signalées au rapport de diagnostic
+            if self.source == 'usager':
+                return lambda user, adresse, logement: format_date_field(user.get(key), header, user)
+            if self.source == 'adresse':
+                return lambda user, adresse, logement: format_date_field(adresse.get(key), header, user)
+            return lambda user, adresse, logement: format_date_field(logement.get(key), header, user)
+        if self.source == 'usager':
+            if formatter:
+                return lambda user, adresse, logement: formatter(user.get(key))
+            return lambda user, adresse, logement: user.get(key, default)
+        if self.source == 'adresse':
+            if formatter:
+                return lambda user, adresse, logement: formatter(adresse.get(key))
+            return lambda user, adresse, logement: adresse.get(key, default)
+        if formatter:
+            return lambda user, adresse, logement: formatter(logement.get(key))
+        return lambda user, adresse, logement: logement.get(key, default)
+
+def _adresse_complete(user, adresse, logement):
+    return f"{adresse.get('rue', '')} {adresse.get('numero', '')}, {adresse.get('codePostal', '')} {adresse.get('ville', '')}"
+
+def _joined_problematiques(user, adresse, logement):
+    return ", ".join([f"{p.get('type', '')}: {p.get('description', '')}" for p in user.get("problematiques", []) if p.get('type') or p.get('description')])
+
+def _joined_actions(user, adresse, logement):
+    return ", ".join([f"{format_date_field(a.get('date'), 'Actions de Suivi', user)} - {a.get('type', '')}: {a.get('description', '')}" for a in user.get("actions", []) if a.get('date') or a.get('type') or a.get('description')])
+
+USAGER_COLUMNS = [
+    ExportColumn("Nom", "nom"),
+    ExportColumn("Prénom", "prenom"),
+    ExportColumn("Date de naissance", "dateNaissance", formatter=format_date),
+    ExportColumn("Genre", "genre"),
+    ExportColumn("Nationalité", "nationalite"),
+    ExportColumn("Langue", "langue"),
+    ExportColumn("Téléphone", "telephone"),
+    ExportColumn("Email", "email"),
+    ExportColumn("Adresse Complète", source='adresse', compute=_adresse_complete, width_cap=LONG_TEXT_WIDTH_CAP),
+    ExportColumn("Rue", "rue", source='adresse'),
+    ExportColumn("Numéro", "numero", source='adresse'),
+    ExportColumn("Boîte", "boite", source='adresse'),
+    ExportColumn("Code Postal", "codePostal", source='adresse'),
+    ExportColumn("Ville", "ville", source='adresse'),
+    ExportColumn("Secteur", "secteur"),
+    ExportColumn("Statut Séjour", "statutSejour"),
+    ExportColumn("Date Ouverture", "dateOuverture", formatter=format_date),
+    ExportColumn("Date Clôture", "dateCloture", formatter=format_date),
+    ExportColumn("État", "etat"),
+    ExportColumn("Antenne", "antenne"),
+    ExportColumn("Gestionnaire", "gestionnaire", formatter=get_gestionnaire_name),
+    ExportColumn("Premier Contact", "premierContact"),
+    ExportColumn("Notes Générales", "notesGenerales", width_cap=LONG_TEXT_WIDTH_CAP),
+    ExportColumn("Procédure Expulsion?", compute=lambda user, adresse, logement: "Oui" if user.get("hasPrevExp") else "Non"),
+    ExportColumn("Date Réception PrevExp", "prevExpDateReception", formatter=format_date),
+    ExportColumn("Date Requête PrevExp", "prevExpDateRequete", formatter=format_date),
+    ExportColumn("Date VAD PrevExp", "prevExpDateVad", formatter=format_date),
+    ExportColumn("Décision PrevExp", "prevExpDecision"),
+    ExportColumn("Commentaire PrevExp", "prevExpCommentaire", width_cap=LONG_TEXT_WIDTH_CAP),
+    ExportColumn("Type Logement", "typeLogement", source='logement'),
+    ExportColumn("Date Entrée Logement", "dateEntree", source='logement', formatter=format_date),
+    ExportColumn("Date Sortie Logement", "dateSortie", source='logement', formatter=format_date),
+    ExportColumn("Motif Sortie Logement", "motifSortie", source='logement'),
+    ExportColumn("Destination Sortie Logement", "destinationSortie", source='logement'),
+    ExportColumn("Propriétaire Logement", "proprietaire", source='logement'),
+    ExportColumn("Loyer Logement", "loyer", source='logement'),
+    ExportColumn("Charges Logement", "charges", source='logement'),
+    ExportColumn("Commentaire Logement", "commentaire", source='logement', width_cap=LONG_TEXT_WIDTH_CAP),
+    ExportColumn("Problématiques", compute=_joined_problematiques, wrap=True, width_cap=WRAP_TEXT_WIDTH_CAP),
+    ExportColumn("Actions de Suivi", compute=_joined_actions, wrap=True, width_cap=WRAP_TEXT_WIDTH_CAP),
+]
+USAGER_COLUMNS_BY_HEADER = {column.header: column for column in USAGER_COLUMNS}
+
+HEADERS = [column.header for column in USAGER_COLUMNS]
+
+WRAP_TEXT_COLUMNS = [column.header for column in USAGER_COLUMNS if column.wrap]
+# Les colonnes Description / Détail sont celles des feuilles Actions et Problématiques (--normalize-children)
+LONG_TEXT_COLUMNS = [column.header for column in USAGER_COLUMNS
+                     if column.width_cap == LONG_TEXT_WIDTH_CAP] + ["Description", "Détail"]
+
+# Export normalisé (--normalize-children) : actions et problématiques dans leurs propres feuilles,
+# reliées à la feuille Usagers par l'id de l'usager
+CHILD_KEY_HEADERS = ["ID Usager", "Nom", "Prénom"]
+ACTION_HEADERS = CHILD_KEY_HEADERS + ["Date", "Type", "Partenaire", "Description"]
+PROBLEMATIQUE_HEADERS = CHILD_KEY_HEADERS + ["Type", "Description", "Détail", "Date Signalement"]
+
+# Noms des styles partagés du mode streaming (un seul enregistrement par classeur)
+STYLE_HEADER = "usagers_header"
+STYLE_ROW_EVEN = "usagers_row_even"
+STYLE_ROW_ODD = "usagers_row_odd"
+STYLE_ROW_EVEN_WRAP = "usagers_row_even_wrap"
+STYLE_ROW_ODD_WRAP = "usagers_row_odd_wrap"
+
+class ColumnWidthTracker:
+    """Accumulates column widths while rows are generated, so no second pass over the sheet is needed."""
+
+    def __init__(self, headers):
+        # La largeur de départ est celle de l'en-tête (petit facteur pour la police plus grande/grasse)
+        self.max_lengths = [len(str(header_title)) * 1.1 for header_title in headers]
+        self.caps = [
+            WRAP_TEXT_WIDTH_CAP if header_title in WRAP_TEXT_COLUMNS
+            else LONG_TEXT_WIDTH_CAP if header_title in LONG_TEXT_COLUMNS
+            else None
+            for header_title in headers
+        ]
+
+    def update(self, row_data):
+        """Takes one row of values into account."""
+        max_lengths = self.max_lengths
+        for col_idx, (value, cap) in enumerate(zip(row_data, self.caps)):
+            if not value:
+                continue
+            cell_length = len(value) if isinstance(value, str) else len(str(value))
+            if cap is not None and cell_length > cap:
+                cell_length = cap
+            if cell_length > max_lengths[col_idx]:
+                max_lengths[col_idx] = cell_length
+
+    def widths(self):
+        """Returns the final column widths, margin included."""
+        return [max_length + 3 for max_length in self.max_lengths]
+
+def parse_logement_details(raw_logement_details, user=None):
+    """Returns logementDetails as a dict, whether stored as an object or a JSON string.
+
+    With the usager, invalid JSON is reported to DIAGNOSTICS.
+    """
+    if isinstance(raw_logement_details, dict):
+        return raw_logement_details
+    if isinstance(raw_logement_details, str) and raw_logement_details.strip().startswith('{'):
+        try:
+            logement_details_data = json.loads(raw_logement_details)
+            if not isinstance(logement_details_data, dict):
+                if user is not None:
+                    DIAGNOSTICS.record('logementDetails', 'json_not_object', raw_logement_details, user)
+                return {}
+            return logement_details_data
+        except json.JSONDecodeError:
+            if user is not None:
+                DIAGNOSTICS.record('logementDetails', 'json_invalid', raw_logement_details, user)
+            return {"commentaire": raw_logement_details}
+    if isinstance(raw_logement_details, str):
+        return {"commentaire": raw_logement_details}
+    return {}
+
+class RowProjector:
+    """Row builder compiled once from a list of column headers (all of USAGER_COLUMNS by default).
+
+    The extractors are resolved up front, and the adresse / logementDetails objects are only
+    prepared when a selected column reads them, so a partial export only computes its own columns.
+    Instances pickle as their header list, which lets them run in the --workers process pool.
+    """
+
+    def __init__(self, headers=None):
+        headers = list(HEADERS if headers is None else headers)
+        unknown = [header_title for header_title in headers if header_title not in USAGER_COLUMNS_BY_HEADER]
+        if unknown:
+            raise ValueError(f"Unknown export columns: {', '.join(unknown)} (available: {', '.join(HEADERS)})")
+        if not headers:
+            raise ValueError("At least one export column is required")
+        self.headers = headers
+        self.columns = [USAGER_COLUMNS_BY_HEADER[header_title] for header_title in headers]
+        self.extractors = [column.compile() for column in self.columns]
+        self.needs_adresse = any(column.source == 'adresse' for column in self.columns)
+        self.needs_logement = any(column.source == 'logement' for column in self.columns)
+
+    def __reduce__(self):
+        return (RowProjector, (self.headers,))
+
+    def __call__(self, user):
+        adresse = None
+        if self.needs_adresse:
+            adresse = user.get('adresse')
+            if not isinstance(adresse, dict):
+                adresse = {}
+        logement = parse_logement_details(user.get('logementDetails'), user) if self.needs_logement else None
+        return [extract(user, adresse, logement) for extract in self.extractors]
+
+    def without_children(self):
+        """The same projection minus the joined Problématiques / Actions de Suivi columns."""
+        return RowProjector([header_title for header_title in self.headers if header_title not in WRAP_TEXT_COLUMNS])
+
+FULL_ROW_PROJECTOR = RowProjector()
+NO_CHILDREN_ROW_PROJECTOR = FULL_ROW_PROJECTOR.without_children()
+
+def parse_export_columns(value):
+    """Parses a comma-separated column list (CLI --columns) or a list of headers; None keeps every column."""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = value.split(",")
+    return [header_title.strip() for header_title in value if header_title.strip()]
+
+def build_user_row(user, include_children=True):
+    """Builds the list of cell values for one usager, in HEADERS order.
+
+    With include_children=False the joined Problématiques / Actions de Suivi columns are left out.
+    """
+    return FULL_ROW_PROJECTOR(user) if include_children else NO_CHILDREN_ROW_PROJECTOR(user)
+
+def build_normalized_user_rows(user, projector=NO_CHILDREN_ROW_PROJECTOR):
+    """Builds (usager row, action rows, problematique rows) for the normalized export.
+
+    projector builds the usager row (without the joined child columns).
+    """
+    user_id = user.get("id", "")
+    key = [user_id, user.get("nom", ""), user.get("prenom", "")]
+    action_rows = [
+        key + [format_date_field(a.get('date'), 'Actions.Date', user), a.get('type', ''), a.get('partenaire', ''), a.get('description', '')]
+        for a in user.get("actions") or [] if a.get('date') or a.get('type') or a.get('description')
+    ]
+    problematique_rows = [
+        key + [p.get('type', ''), p.get('description', ''), p.get('detail', ''),
+               format_date_field(p.get('dateSignalement'), 'Problématiques.Date Signalement', user)]
+        for p in user.get("problematiques") or [] if p.get('type') or p.get('description')
+    ]
+    return [user_id] + projector(user), action_rows, problematique_rows
+
+# Nombre d'usagers envoyés à la fois à un processus du pool (mode --workers)
+ROW_CHUNK_SIZE = 500
+
+def _build_rows_chunk(users_chunk, row_builder=build_user_row):
+    """Pool task: builds the rows of a chunk and returns them with the date counters and diagnostics it
+    produced, and the peak RSS of the pool process so far."""
+    global DIAGNOSTICS
+    counters_before = Counter(DATE_NORMALIZER.counters)
+    DIAGNOSTICS = ExportDiagnostics()
+    rows = [row_builder(user) for user in users_chunk]
+    return rows, DATE_NORMALIZER.counters - counters_before, DIAGNOSTICS, process_peak_rss_mb()
+
+def iter_user_rows(users_data, workers=1, chunk_size=ROW_CHUNK_SIZE, row_builder=build_user_row):
+    """Yields row_builder(user) for each usager in order, in a process pool when workers > 1.
+
+    At most 2 chunks per process are in flight, so memory stays bounded even for a
+    streamed input; the date counters of the pool processes are merged into DATE_NORMALIZER,
+    their diagnostics into DIAGNOSTICS and their peak RSS into INSTRUMENTATION.
+    """
+    if workers <= 1:
+        row_builder = INSTRUMENTATION.timed('row_build', row_builder)
+        for user in users_data:
+            yield row_builder(user)
+        return
+
+    users_iter = iter(users_data)
+    chunks = iter(lambda: list(itertools.islice(users_iter, chunk_size)), [])
+    # Les processus forkés héritent du pic de RSS du parent : il est remis à zéro à leur démarrage
+    with ProcessPoolExecutor(max_workers=workers, initializer=reset_peak_rss) as executor:
+        in_flight = deque(executor.submit(_build_rows_chunk, chunk, row_builder)
+                          for chunk in itertools.islice(chunks, workers * 2))
+        while in_flight:
+            with INSTRUMENTATION.phase('row_build'):
+                rows, date_counters, chunk_diagnostics, pool_peak_mb = in_flight.popleft().result()
+            next_chunk = next(chunks, None)
+            if next_chunk is not None:
+                in_flight.append(executor.submit(_build_rows_chunk, next_chunk, row_builder))
+            DATE_NORMALIZER.counters.update(date_counters)
+            DIAGNOSTICS.merge(chunk_diagnostics)
+            INSTRUMENTATION.record_pool_peak(pool_peak_mb)
+            yield from rows
+
+def create_excel_export(users_data, output_path, streaming=False, workers=1, group_by=None,
+                        normalize_children=False, columns=None):
+    """Creates an Excel file from user data.
+
+    columns restricts the export to these headers (in this order); None exports every column.
+    """
+    projector = FULL_ROW_PROJECTOR if columns is None else RowProjector(columns)
+    if group_by:
+        # Le regroupement n'existe qu'en mode streaming (une feuille write-only par groupe)
+        create_grouped_excel_export(users_data, output_path, group_by, workers, projector)
+        return
+    if streaming or normalize_children:
+        create_streaming_excel_export(users_data, output_path, workers, normalize_children, projector)
+        return
+
     workbook = openpyxl.Workbook()
     sheet = workbook.active
     sheet.title = "Usagers"
 
-    headers = [
-        "Nom", "Prénom", "Date de naissance", "Genre", "Nationalité",
-        "Langue", "Téléphone", "Email",
-        "Adresse Complète", "Rue", "Numéro", "Boîte", "Code Postal", "Ville",
-        "Secteur", "Statut Séjour", "Date Ouverture", "Date Clôture", "État",
-        "Antenne", "Gestionnaire", "Premier Contact", "Notes Générales",
-        "Procédure Expulsion?", "Date Réception PrevExp", "Date Requête PrevExp",
-        "Date VAD PrevExp", "Décision PrevExp", "Commentaire PrevExp",
-        "Type Logement", "Date Entrée Logement", "Date Sortie Logement",
-        "Motif Sortie Logement", "Destination Sortie Logement", "Propriétaire Logement",
-        "Loyer Logement", "Charges Logement", "Commentaire Logement",
-        "Problématiques", "Actions de Suivi"
-    ]
+    headers = projector.headers
 
     # Style pour les en-têtes
     header_font = Font(name='Calibri', size=12, bold=True, color="FFFFFF") # Police plus grande, toujours en gras
@@ -126,147 +696,792 @@ def create_excel_export(users_data, output_path):
     light_fill = PatternFill(start_color="DDEBF7", end_color="DDEBF7", fill_type="solid")
     no_fill = PatternFill(fill_type=None)
 
-    wrap_text_columns = ["Problématiques", "Actions de Suivi"]
+    column_alignments = [data_alignment_wrap if column.wrap else data_alignment_default for column in projector.columns]
+    width_tracker = ColumnWidthTracker(headers)
+    update_widths = INSTRUMENTATION.timed('width_sizing', width_tracker.update)
 
-    for row_idx, user in enumerate(users_data, 0):
+    for row_idx, row_data in enumerate(iter_user_rows(users_data, workers, row_builder=projector), 0):
         row_num_excel = row_idx + 2
 
-        adresse_data = user.get('adresse') if isinstance(user.get('adresse'), dict) else {}
-        logement_details_data = {}
-        raw_logement_details = user.get('logementDetails')
-        if isinstance(raw_logement_details, dict):
-            logement_details_data = raw_logement_details
-        elif isinstance(raw_logement_details, str) and raw_logement_details.strip().startswith('{'):
-            try:
-                logement_details_data = json.loads(raw_logement_details)
-                if not isinstance(logement_details_data, dict):
-                    logement_details_data = {}
-            except json.JSONDecodeError:
-                logement_details_data = {"commentaire": raw_logement_details}
-        elif isinstance(raw_logement_details, str):
-             logement_details_data = {"commentaire": raw_logement_details}
-
-        row_data = [
-            user.get("nom", ""),
-            user.get("prenom", ""),
-            format_date(user.get("dateNaissance")),
-            user.get("genre", ""),
-            user.get("nationalite", ""),
-            user.get("langue", ""),
-            user.get("telephone", ""),
-            user.get("email", ""),
-            f"{adresse_data.get('rue', '')} {adresse_data.get('numero', '')}, {adresse_data.get('codePostal', '')} {adresse_data.get('ville', '')}",
-            adresse_data.get("rue", ""),
-            adresse_data.get("numero", ""),
-            adresse_data.get("boite", ""),
-            adresse_data.get("codePostal", ""),
-            adresse_data.get("ville", ""),
-            user.get("secteur", ""),
-            user.get("statutSejour", ""),
-            format_date(user.get("dateOuverture")),
-            format_date(user.get("dateCloture")),
-            user.get("etat", ""),
-            user.get("antenne", ""),
-            get_gestionnaire_name(user.get("gestionnaire")),
-            user.get("premierContact", ""),
-            user.get("notesGenerales", ""),
-            "Oui" if user.get("hasPrevExp") else "Non",
-            format_date(user.get("prevExpDateReception")),
-            format_date(user.get("prevExpDateRequete")),
-            format_date(user.get("prevExpDateVad")),
-            user.get("prevExpDecision", ""),
-            user.get("prevExpCommentaire", ""),
-            logement_details_data.get("typeLogement", ""),
-            format_date(logement_details_data.get("dateEntree")),
-            format_date(logement_details_data.get("dateSortie")),
-            logement_details_data.get("motifSortie", ""),
-            logement_details_data.get("destinationSortie", ""),
-            logement_details_data.get("proprietaire", ""),
-            logement_details_data.get("loyer", ""),
-            logement_details_data.get("charges", ""),
-            logement_details_data.get("commentaire", ""),
-            ", ".join([f"{p.get('type', '')}: {p.get('description', '')}" for p in user.get("problematiques", []) if p.get('type') or p.get('description')]),
-            ", ".join([f"{format_date(a.get('date'))} - {a.get('type', '')}: {a.get('description', '')}" for a in user.get("actions", []) if a.get('date') or a.get('type') or a.get('description')])
-        ]
+        update_widths(row_data)
 
         current_row_fill = light_fill if row_idx % 2 == 0 else no_fill
 
-        for col_num, cell_data in enumerate(row_data, 1):
-            col_letter = get_column_letter(col_num)
-            cell = sheet[f"{col_letter}{row_num_excel}"]
-            cell.value = cell_data
-            cell.font = data_font # Appliquer la police de données
-            cell.border = thin_border
-            cell.fill = current_row_fill
-
-            current_header_title = headers[col_num - 1]
-            if current_header_title in wrap_text_columns:
-                cell.alignment = data_alignment_wrap
+        with INSTRUMENTATION.phase('styling'):
+            for col_num, cell_data in enumerate(row_data, 1):
+                col_letter = get_column_letter(col_num)
+                cell = sheet[f"{col_letter}{row_num_excel}"]
+                cell.value = cell_data
+                cell.font = data_font # Appliquer la police de données
+                cell.border = thin_border
+                cell.fill = current_row_fill
+                cell.alignment = column_alignments[col_num - 1]
+
+    # Ajuster la largeur des colonnes (statistiques accumulées pendant la génération des lignes)
+    with INSTRUMENTATION.phase('width_sizing'):
+        for col_num, adjusted_width in enumerate(width_tracker.widths(), 1):
+            sheet.column_dimensions[get_column_letter(col_num)].width = adjusted_width
+
+    sheet.freeze_panes = 'A2'
+    _add_diagnostics_sheet(workbook)
+    with INSTRUMENTATION.phase('save'):
+        workbook.save(output_path)
+
+def _add_diagnostics_sheet(workbook):
+    """Adds the hidden Diagnostics sheet (one row per field) when the export asked for it."""
+    if not DIAGNOSTICS.include_sheet:
+        return
+    sheet = workbook.create_sheet(DIAGNOSTICS_SHEET_TITLE)
+    sheet.sheet_state = 'hidden'
+    headers = ["Champ", "Occurrences", "Types d'erreur", "Exemples", "Usagers concernés"]
+    if workbook.write_only:
+        header_cells = []
+        for header_title in headers:
+            cell = WriteOnlyCell(sheet, value=header_title)
+            cell.style = STYLE_HEADER
+            header_cells.append(cell)
+        sheet.append(header_cells)
+    else:
+        sheet.append(headers)
+    for field, entry in DIAGNOSTICS.report()['by_field'].items():
+        usager_ids = ", ".join(str(usager_id) for usager_id in entry['usager_ids'])
+        sheet.append([
+            field,
+            entry['count'],
+            ", ".join(f"{kind}: {count}" for kind, count in entry['kinds'].items()),
+            " | ".join(entry['samples']),
+            usager_ids + (", ..." if entry['usager_ids_truncated'] else ""),
+        ])
+
+def _register_export_styles(workbook):
+    """Registers the shared named styles used by the streaming export."""
+    thin_border = Border(left=Side(style='thin'), right=Side(style='thin'), top=Side(style='thin'), bottom=Side(style='thin'))
+    data_font = Font(name='Calibri', size=11)
+    light_fill = PatternFill(start_color="DDEBF7", end_color="DDEBF7", fill_type="solid")
+    no_fill = PatternFill(fill_type=None)
+    data_alignment_default = Alignment(horizontal="left", vertical="top", wrap_text=False)
+    data_alignment_wrap = Alignment(horizontal="left", vertical="top", wrap_text=True)
+
+    workbook.add_named_style(NamedStyle(
+        name=STYLE_HEADER,
+        font=Font(name='Calibri', size=12, bold=True, color="FFFFFF"),
+        fill=PatternFill(start_color="4F81BD", end_color="4F81BD", fill_type="solid"),
+        border=thin_border,
+        alignment=Alignment(horizontal="center", vertical="center", wrap_text=True),
+    ))
+    for name, fill, alignment in [
+        (STYLE_ROW_EVEN, light_fill, data_alignment_default),
+        (STYLE_ROW_ODD, no_fill, data_alignment_default),
+        (STYLE_ROW_EVEN_WRAP, light_fill, data_alignment_wrap),
+        (STYLE_ROW_ODD_WRAP, no_fill, data_alignment_wrap),
+    ]:
+        workbook.add_named_style(NamedStyle(name=name, font=data_font, fill=fill, border=thin_border, alignment=alignment))
+
+def _splice_column_widths(sheet, widths):
+    """Inserts the <cols> element into a write-only sheet whose rows are already written.
+
+    openpyxl writes <cols> before <sheetData>, i.e. before the first row is known. The sheet
+    is closed here and its temporary XML file rewritten with the widths in front of
+    <sheetData>; the rows themselves are copied as-is, in chunks. This relies on openpyxl's
+    private temporary file (sheet._writer.out, pinned version in the Dockerfile): if it is not
+    available, the sheet keeps the default widths.
+    """
+    sheet.close()
+    source_path = getattr(getattr(sheet, '_writer', None), 'out', None)
+    if not isinstance(source_path, str) or not os.path.exists(source_path):
+        print("⚠️ Largeurs de colonnes ignorées : fichier temporaire openpyxl introuvable", file=sys.stderr)
+        return
+    cols_xml = "<cols>" + "".join(
+        f'<col min="{col_num}" max="{col_num}" width="{width:.2f}" customWidth="1"/>'
+        for col_num, width in enumerate(widths, 1)
+    ) + "</cols>"
+
+    spliced_path = source_path + ".cols"
+    with open(source_path, 'rb') as source, open(spliced_path, 'wb') as target:
+        head = source.read(64 * 1024)
+        insert_at = head.find(b"<sheetData")
+        if insert_at == -1:
+            # Ne devrait pas arriver : on garde la feuille sans largeurs plutôt que de la corrompre
+            os.remove(spliced_path)
+            return
+        target.write(head[:insert_at])
+        target.write(cols_xml.encode('utf-8'))
+        target.write(head[insert_at:])
+        shutil.copyfileobj(source, target)
+    os.replace(spliced_path, source_path)
+
+class StreamingUsagersSheet:
+    """A write-only usagers sheet: styled header, alternating row styles and single-pass widths.
+
+    The workbook must have been prepared with _register_export_styles.
+    """
+
+    def __init__(self, workbook, title, headers=HEADERS):
+        self.sheet = workbook.create_sheet(title)
+        self.row_count = 0
+        self.width_tracker = ColumnWidthTracker(headers)
+
+        # En mode write-only, la hauteur d'en-tête et le gel des volets doivent être posés avant la première ligne.
+        # Les largeurs de colonnes ne sont connues qu'à la fin : elles sont insérées par _splice_column_widths.
+        self.sheet.row_dimensions[1].height = 30
+        self.sheet.freeze_panes = 'A2'
+
+        header_cells = []
+        for header_title in headers:
+            cell = WriteOnlyCell(self.sheet, value=header_title)
+            cell.style = STYLE_HEADER
+            header_cells.append(cell)
+        self.sheet.append(header_cells)
+
+        wrap_flags = [header_title in WRAP_TEXT_COLUMNS for header_title in headers]
+        self.even_styles = [STYLE_ROW_EVEN_WRAP if wrap else STYLE_ROW_EVEN for wrap in wrap_flags]
+        self.odd_styles = [STYLE_ROW_ODD_WRAP if wrap else STYLE_ROW_ODD for wrap in wrap_flags]
+        self._update_widths = INSTRUMENTATION.timed('width_sizing', self.width_tracker.update)
+        self._append_styled = INSTRUMENTATION.timed('styling', self._append_styled)
+
+    def append(self, row_data):
+        self._update_widths(row_data)
+        self._append_styled(row_data)
+        self.row_count += 1
+
+    def _append_styled(self, row_data):
+        row_styles = self.even_styles if self.row_count % 2 == 0 else self.odd_styles
+        row_cells = []
+        for cell_data, style_name in zip(row_data, row_styles):
+            cell = WriteOnlyCell(self.sheet, value=cell_data)
+            cell.style = style_name
+            row_cells.append(cell)
+        self.sheet.append(row_cells)
+
+    def close(self):
+        with INSTRUMENTATION.phase('width_sizing'):
+            _splice_column_widths(self.sheet, self.width_tracker.widths())
+
+def create_streaming_excel_export(users_data, output_path, workers=1, normalize_children=False,
+                                  projector=FULL_ROW_PROJECTOR):
+    """Creates the Excel file with a write-only worksheet, emitting rows as they are built.
+
+    users_data can be any iterable (list or generator): only the current row is kept in memory
+    (plus the chunks in flight when workers > 1). With normalize_children, actions and
+    problématiques go to their own "Actions" / "Problématiques" sheets, keyed by usager id,
+    instead of being joined into two wide cells. projector selects the usager columns.
+    """
+    workbook = openpyxl.Workbook(write_only=True)
+    _register_export_styles(workbook)
+
+    if not normalize_children:
+        usagers_sheet = StreamingUsagersSheet(workbook, "Usagers", projector.headers)
+        for row_data in iter_user_rows(users_data, workers, row_builder=projector):
+            usagers_sheet.append(row_data)
+        usagers_sheet.close()
+        _add_diagnostics_sheet(workbook)
+        with INSTRUMENTATION.phase('save'):
+            workbook.save(output_path)
+        return
+
+    user_projector = projector.without_children()
+    usagers_sheet = StreamingUsagersSheet(workbook, "Usagers", ["ID"] + user_projector.headers)
+    actions_sheet = StreamingUsagersSheet(workbook, "Actions", ACTION_HEADERS)
+    problematiques_sheet = StreamingUsagersSheet(workbook, "Problématiques", PROBLEMATIQUE_HEADERS)
+    row_builder = functools.partial(build_normalized_user_rows, projector=user_projector)
+    for user_row, action_rows, problematique_rows in iter_user_rows(users_data, workers, row_builder=row_builder):
+        usagers_sheet.append(user_row)
+        for action_row in action_rows:
+            actions_sheet.append(action_row)
+        for problematique_row in problematique_rows:
+            problematiques_sheet.append(problematique_row)
+
+    for sheet in (usagers_sheet, actions_sheet, problematiques_sheet):
+        sheet.close()
+    _add_diagnostics_sheet(workbook)
+    with INSTRUMENTATION.phase('save'):
+        workbook.save(output_path)
+
+# Colonne utilisée pour chaque mode de regroupement (--group-by)
+GROUP_BY_COLUMNS = {
+    'antenne': "Antenne",
+    'gestionnaire': "Gestionnaire",
+    'secteur': "Secteur",
+}
+EMPTY_GROUP_LABEL = "Non renseigné"
+SUMMARY_SHEET_TITLE = "Synthèse"
+
+def _safe_sheet_title(label, used_titles):
+    """Returns a valid, unique Excel sheet title (31 chars max, no []:*?/\\)."""
+    title = re.sub(r"[\[\]:*?/\\]", "-", label).strip("' ") or EMPTY_GROUP_LABEL
+    title = title[:31]
+    candidate, suffix = title, 2
+    while candidate.lower() in used_titles:
+        marker = f" ({suffix})"
+        candidate = title[:31 - len(marker)] + marker
+        suffix += 1
+    used_titles.add(candidate.lower())
+    return candidate
+
+def create_grouped_excel_export(users_data, output_path, group_by, workers=1, projector=FULL_ROW_PROJECTOR):
+    """Writes one sheet per antenne, gestionnaire or secteur plus a summary sheet, in a single pass.
+
+    Each row is appended to its group's write-only sheet as soon as it is built, so no
+    row is kept or duplicated in memory.
+    """
+    if GROUP_BY_COLUMNS[group_by] not in projector.headers:
+        raise ValueError(f"Column {GROUP_BY_COLUMNS[group_by]!r} must be exported to group by {group_by}")
+    group_col_idx = projector.headers.index(GROUP_BY_COLUMNS[group_by])
+
+    workbook = openpyxl.Workbook(write_only=True)
+    _register_export_styles(workbook)
+    # Créée en premier pour être le premier onglet ; ses lignes sont écrites à la fin
+    summary_sheet = workbook.create_sheet(SUMMARY_SHEET_TITLE)
+    used_titles = {SUMMARY_SHEET_TITLE.lower()}
+    group_sheets = {}
+
+    for row_data in iter_user_rows(users_data, workers, row_builder=projector):
+        group_label = str(row_data[group_col_idx] or "").strip() or EMPTY_GROUP_LABEL
+        group_sheet = group_sheets.get(group_label)
+        if group_sheet is None:
+            group_sheet = StreamingUsagersSheet(workbook, _safe_sheet_title(group_label, used_titles),
+                                                projector.headers)
+            group_sheets[group_label] = group_sheet
+        group_sheet.append(row_data)
+
+    summary_headers = [GROUP_BY_COLUMNS[group_by], "Onglet", "Nombre d'usagers"]
+    summary_sheet.column_dimensions['A'].width = max([len(label) for label in group_sheets] + [20]) + 3
+    summary_sheet.column_dimensions['B'].width = 34
+    summary_sheet.column_dimensions['C'].width = 20
+    summary_sheet.row_dimensions[1].height = 30
+    header_cells = []
+    for header_title in summary_headers:
+        cell = WriteOnlyCell(summary_sheet, value=header_title)
+        cell.style = STYLE_HEADER
+        header_cells.append(cell)
+    summary_sheet.append(header_cells)
+
+    for row_idx, (group_label, group_sheet) in enumerate(sorted(group_sheets.items())):
+        style_name = STYLE_ROW_EVEN if row_idx % 2 == 0 else STYLE_ROW_ODD
+        summary_row = []
+        for value in [group_label, group_sheet.sheet.title, group_sheet.row_count]:
+            cell = WriteOnlyCell(summary_sheet, value=value)
+            cell.style = style_name
+            summary_row.append(cell)
+        summary_sheet.append(summary_row)
+        group_sheet.close()
+
+    total_cells = []
+    for value in ["Total", "", sum(group_sheet.row_count for group_sheet in group_sheets.values())]:
+        cell = WriteOnlyCell(summary_sheet, value=value)
+        cell.style = STYLE_HEADER
+        total_cells.append(cell)
+    summary_sheet.append(total_cells)
+
+    _add_diagnostics_sheet(workbook)
+    with INSTRUMENTATION.phase('save'):
+        workbook.save(output_path)
+
+# Formats de sortie (--format) : classeur stylé, ou données tabulaires brutes
+EXPORT_FORMATS = ['xlsx', 'csv', 'parquet']
+# Séparateur par défaut : Excel en locale française/belge attend ';' pour ouvrir un CSV directement
+CSV_DELIMITER = ";"
+# Nombre de lignes par row group Parquet (et donc gardées en mémoire à la fois)
+PARQUET_BATCH_ROWS = 10000
+
+def _cell_text(value):
+    """Parquet columns are typed as strings: None stays null, everything else goes through str()."""
+    return None if value is None else str(value)
+
+def create_csv_export(users_data, output_path, workers=1, projector=FULL_ROW_PROJECTOR, delimiter=CSV_DELIMITER):
+    """Streams the flattened usager rows to a UTF-8 CSV file with BOM (so Excel detects the encoding)."""
+    with open(output_path, 'w', encoding='utf-8-sig', newline='') as f:
+        writer = csv.writer(f, delimiter=delimiter)
+        writer.writerow(projector.headers)
+        with INSTRUMENTATION.phase('save'):
+            writer.writerows(iter_user_rows(users_data, workers, row_builder=projector))
+
+def create_parquet_export(users_data, output_path, workers=1, projector=FULL_ROW_PROJECTOR,
+                          batch_rows=PARQUET_BATCH_ROWS):
+    """Writes the flattened usager rows to a Parquet file, one row group per batch_rows usagers."""
+    # Import tardif : pyarrow n'est nécessaire (et son import n'est payé) que pour --format parquet
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ValueError("Parquet export requires pyarrow (pip install pyarrow)") from None
+    schema = pyarrow.schema([(header_title, pyarrow.string()) for header_title in projector.headers])
+    rows = iter_user_rows(users_data, workers, row_builder=projector)
+    with pyarrow.parquet.ParquetWriter(output_path, schema, compression='snappy') as writer:
+        for batch in iter(lambda: list(itertools.islice(rows, batch_rows)), []):
+            with INSTRUMENTATION.phase('save'):
+                columns = [[_cell_text(value) for value in column] for column in zip(*batch)]
+                writer.write_table(pyarrow.Table.from_arrays(
+                    [pyarrow.array(column, type=pyarrow.string()) for column in columns], schema=schema))
+
+def create_export(users_data, output_path, output_format='xlsx', streaming=False, workers=1, group_by=None,
+                  normalize_children=False, columns=None, csv_delimiter=CSV_DELIMITER, diagnostics_sheet=False):
+    """Dispatches to the Excel export or to the CSV / Parquet writers, which share the same row projector.
+
+    Returns the ExportDiagnostics of this export; with diagnostics_sheet, an xlsx export also
+    carries them in a hidden "Diagnostics" sheet. Under instrumented_run, input decoding and
+    date parsing are timed as their own phases.
+    """
+    global DIAGNOSTICS
+    if group_by and group_by not in GROUP_BY_COLUMNS:
+        raise ValueError(f"Unknown group_by: {group_by} (expected one of {', '.join(sorted(GROUP_BY_COLUMNS))})")
+    if group_by and normalize_children:
+        raise ValueError("group_by and normalize_children cannot be combined")
+    DIAGNOSTICS = ExportDiagnostics(include_sheet=diagnostics_sheet and output_format == 'xlsx')
+    users_data = INSTRUMENTATION.timed_iter('json_load', users_data)
+    with INSTRUMENTATION.patched(DATE_NORMALIZER, 'format', 'date_parsing'):
+        _create_export(users_data, output_path, output_format, streaming, workers, group_by,
+                       normalize_children, columns, csv_delimiter)
+    return DIAGNOSTICS
+
+def _create_export(users_data, output_path, output_format, streaming, workers, group_by,
+                   normalize_children, columns, csv_delimiter):
+    if output_format == 'xlsx':
+        create_excel_export(users_data, output_path, streaming, workers, group_by, normalize_children, columns)
+        return
+    if output_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format: {output_format} (expected one of {', '.join(EXPORT_FORMATS)})")
+    if group_by or normalize_children:
+        raise ValueError("group_by and normalize_children are only available for the xlsx format")
+    projector = FULL_ROW_PROJECTOR if columns is None else RowProjector(columns)
+    if output_format == 'csv':
+        create_csv_export(users_data, output_path, workers, projector, csv_delimiter)
+    else:
+        create_parquet_export(users_data, output_path, workers, projector)
+
+# Cache des exports (--cache) : un fichier par empreinte (données + options), évincé par âge puis par taille
+EXPORT_CACHE_DIR = os.path.join(tempfile.gettempdir(), "socialconnect_export_cache")
+EXPORT_CACHE_MAX_BYTES = 500 * 1024 * 1024
+EXPORT_CACHE_MAX_AGE = 24 * 3600
+
+@functools.lru_cache(maxsize=None)
+def export_code_fingerprint():
+    """Hash of this script and of the openpyxl version: any change to the export code invalidates the cache."""
+    with open(os.path.abspath(__file__), 'rb') as f:
+        source = f.read()
+    return hashlib.sha256(source + b"\0openpyxl " + openpyxl.__version__.encode('ascii')).hexdigest()
+
+class ExportCache:
+    """Content-addressed cache of produced exports, stored as <key>.<format> in cache_dir.
+
+    The key hashes the export options with either a caller-provided version key or the raw
+    bytes of the input file (read in chunks, never decoded), plus export_code_fingerprint(). A hit is copied to the requested output;
+    entries are evicted by age first, then least recently used until the directory fits in max_bytes.
+
+    The exports hold usagers' personal data: cache_dir is created private (0700) and must be
+    owned by the current user.
+    """
+
+    def __init__(self, cache_dir=EXPORT_CACHE_DIR, max_bytes=EXPORT_CACHE_MAX_BYTES, max_age=EXPORT_CACHE_MAX_AGE):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+        stat = os.stat(cache_dir)
+        if hasattr(os, 'getuid') and stat.st_uid != os.getuid():
+            raise PermissionError(f"Export cache directory {cache_dir} is not owned by the current user")
+        if stat.st_mode & 0o077:
+            os.chmod(cache_dir, 0o700)  # répertoire créé par une version antérieure avec l'umask par défaut
+
+    @staticmethod
+    def key_for(input_json_path, options, version_key=None):
+        digest = hashlib.sha256()
+        digest.update(json.dumps([export_code_fingerprint(), options], sort_keys=True, default=str).encode('utf-8'))
+        if version_key is not None:
+            digest.update(b"version:" + str(version_key).encode('utf-8'))
+        else:
+            # Octets bruts : décoder puis resérialiser chaque usager coûtait plus cher que l'export d'un fichier en cache
+            with open(input_json_path, 'rb') as f:
+                for chunk in iter(lambda: f.read(INPUT_CHUNK_SIZE), b''):
+                    digest.update(chunk)
+        return digest.hexdigest()
+
+    def path_for(self, key, output_format):
+        return os.path.join(self.cache_dir, f"{key}.{output_format}")
+
+    def fetch(self, key, output_format, output_path):
+        """Copies the cached file to output_path; returns False on a miss."""
+        cached_path = self.path_for(key, output_format)
+        try:
+            shutil.copyfile(cached_path, output_path)
+        except FileNotFoundError:
+            return False
+        os.utime(cached_path)  # la date de modification sert d'horodatage LRU
+        return True
+
+    def store(self, key, output_format, produced_path):
+        """Adds a produced export to the cache (atomically), then evicts old entries."""
+        cached_path = self.path_for(key, output_format)
+        staging_path = f"{cached_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        shutil.copyfile(produced_path, staging_path)
+        os.replace(staging_path, cached_path)
+        self.evict()
+
+    def evict(self):
+        """Removes entries older than max_age, then the least recently used ones beyond max_bytes."""
+        now = time.time()
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if not entry.is_file() or entry.name.endswith('.tmp'):
+                continue
+            stat = entry.stat()
+            if now - stat.st_mtime > self.max_age:
+                self._remove(entry.path)
             else:
-                cell.alignment = data_alignment_default
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total_size <= self.max_bytes:
+                break
+            self._remove(path)
+            total_size -= size
 
-    # Ajuster la largeur des colonnes
-    for col_num, header_title in enumerate(headers, 1):
-        col_letter = get_column_letter(col_num)
-        max_length = 0
-
-        # Prendre en compte la longueur de l'en-tête (avec une police potentiellement plus grande)
-        # On peut estimer un facteur d'ajustement si la police de l'en-tête est plus grande
-        # ou simplement s'assurer que la largeur est suffisante pour l'en-tête.
-        header_cell_value = sheet[f"{col_letter}1"].value
-        if header_cell_value:
-             # Si l'en-tête peut aller à la ligne, on peut prendre la plus longue "partie" ou une estimation
-             # Pour simplifier, on prend la longueur totale, wrap_text dans l'en-tête aidera.
-             max_length = len(str(header_cell_value)) * 1.1 # Petit facteur pour police plus grande/gras
-
-        column_data_cells = sheet[col_letter][1:] # Cellules de données uniquement
-        for cell in column_data_cells:
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass  # déjà évincé par un autre processus
+
+def create_cached_export(input_json_path, output_path, cache, version_key=None, workers=1, **export_options):
+    """Runs create_export through an ExportCache; returns (cache_hit, diagnostics).
+
+    diagnostics is None on a cache hit (nothing was parsed).
+
+    export_options are the create_export keyword arguments (output_format, streaming, group_by,
+    normalize_children, columns, csv_delimiter, diagnostics_sheet); they are all part of the cache key.
+    """
+    export_options.setdefault('output_format', 'xlsx')
+    with INSTRUMENTATION.phase('cache_lookup'):
+        key = cache.key_for(input_json_path, export_options, version_key)
+        if cache.fetch(key, export_options['output_format'], output_path):
+            return True, None
+    diagnostics = create_export(read_users_stream(input_json_path), output_path, workers=workers, **export_options)
+    cache.store(key, export_options['output_format'], output_path)
+    return False, diagnostics
+
+_export_cache = None
+
+def get_export_cache(cache_dir=EXPORT_CACHE_DIR, max_bytes=EXPORT_CACHE_MAX_BYTES, max_age=EXPORT_CACHE_MAX_AGE):
+    """Returns the process-wide ExportCache (created on first use with these settings)."""
+    global _export_cache
+    if _export_cache is None:
+        _export_cache = ExportCache(cache_dir, max_bytes, max_age)
+    return _export_cache
+
+# Taille par défaut de la file d'attente du worker persistant
+WORKER_QUEUE_SIZE = 8
+
+def run_export_job(job):
+    """Runs one export job (dict with input, optional output, format, streaming...) and returns the response dict.
+
+    Without output, the file comes back base64-encoded (xlsx_base64 for workbooks, data_base64 otherwise).
+    With cache (or a cache_key version), the export goes through the worker's ExportCache and the
+    response tells whether it was a cache_hit. Parsing problems come back aggregated under diagnostics
+    (and in a hidden sheet with diagnostics_sheet). With metrics (or profile, a cProfile dump path), the
+    response carries the instrumentation summary under metrics.
+    """
+    job_id = job.get('id')
+    started = time.perf_counter()
+    output_path = None
+    return_bytes = False
+    export_started = False
+    succeeded = False
+    try:
+        input_json_path = job['input']
+        output_path = job.get('output')
+        output_format = job.get('format', 'xlsx')
+        return_bytes = not output_path
+        if return_bytes:
+            fd, output_path = tempfile.mkstemp(suffix=f'.{output_format}', prefix='export_usagers_')
+            os.close(fd)
+
+        export_options = {
+            'output_format': output_format,
+            'streaming': job.get('streaming', True),
+            'group_by': job.get('group_by'),
+            'normalize_children': job.get('normalize_children', False),
+            'columns': parse_export_columns(job.get('columns')),
+            'csv_delimiter': job.get('csv_delimiter', CSV_DELIMITER),
+            'diagnostics_sheet': job.get('diagnostics_sheet', False),
+        }
+        cache_hit = None
+        instrumentation = Instrumentation(enabled=bool(job.get('metrics') or job.get('profile')),
+                                          profile_path=job.get('profile'))
+        export_started = True
+        with instrumented_run(instrumentation):
+            if job.get('cache') or job.get('cache_key') is not None:
+                cache_hit, diagnostics = create_cached_export(input_json_path, output_path, get_export_cache(),
+                                                              job.get('cache_key'), workers=job.get('workers', 1),
+                                                              **export_options)
+            else:
+                diagnostics = create_export(read_users_stream(input_json_path), output_path,
+                                            workers=job.get('workers', 1), **export_options)
+
+        response = {'id': job_id, 'ok': True, 'duration_ms': round((time.perf_counter() - started) * 1000)}
+        if cache_hit is not None:
+            response['cache_hit'] = cache_hit
+        if instrumentation.enabled:
+            response['metrics'] = instrumentation.summary(script='export_users_excel', format=output_format)
+        if diagnostics is not None and diagnostics.total:
+            response['diagnostics'] = diagnostics.report()
+        if return_bytes:
+            with open(output_path, 'rb') as f:
+                data_key = 'xlsx_base64' if output_format == 'xlsx' else 'data_base64'
+                response[data_key] = base64.b64encode(f.read()).decode('ascii')
+        else:
+            response['output'] = output_path
+        succeeded = True
+        return response
+    except KeyError as e:
+        return {'id': job_id, 'ok': False, 'error': f"Missing job field: {e}"}
+    except FileNotFoundError:
+        return {'id': job_id, 'ok': False, 'error': f"Input JSON file not found at {job.get('input')}"}
+    except json.JSONDecodeError as e:
+        return {'id': job_id, 'ok': False, 'error': f"Error decoding JSON from {job.get('input')}: {e.msg}"}
+    except Exception as ex:
+        return {'id': job_id, 'ok': False, 'error': str(ex)}
+    finally:
+        # Le fichier temporaire ne survit jamais au job ; en cas d'échec, un export partiel
+        # (le CSV est écrit au fil de l'eau) contiendrait des données d'usagers tronquées
+        if output_path and (return_bytes or (export_started and not succeeded)):
             try:
-                if cell.value:
-                    cell_length = len(str(cell.value))
-                    if header_title in wrap_text_columns:
-                        max_length = max(max_length, min(cell_length, 50))
-                    elif header_title in ["Notes Générales", "Commentaire Logement", "Commentaire PrevExp", "Adresse Complète"]:
-                        max_length = max(max_length, min(cell_length, 70))
-                    else:
-                        max_length = max(max_length, cell_length)
-            except:
+                os.remove(output_path)
+            except FileNotFoundError:
                 pass
 
-        # Ajuster la largeur, s'assurer qu'elle est au moins suffisante pour l'en-tête
-        # La largeur de l'en-tête est déjà dans max_length, on ajoute une marge.
-        adjusted_width = (max_length + 3) # Augmenter légèrement la marge
-        sheet.column_dimensions[col_letter].width = adjusted_width
+class ExportWorker:
+    """Long-lived export worker: imports stay warm and jobs go through a bounded queue.
 
+    Jobs are executed one at a time by a single thread (openpyxl is CPU bound, threads
+    would only contend for the GIL); submit() returns a Future with the response dict.
+    on_start, if given, is called by that thread right before the job runs.
+    """
 
-    sheet.freeze_panes = 'A2'
-    workbook.save(output_path)
+    def __init__(self, queue_size=WORKER_QUEUE_SIZE):
+        self.jobs = queue.Queue(maxsize=queue_size)
+        self._thread = threading.Thread(target=self._run, name="export-worker", daemon=True)
+        self._thread.start()
 
-if __name__ == "__main__":
-    if len(sys.argv) != 3:
-        sys.stderr.write("Usage: python export_users_excel.py <input_json_path> <output_excel_path>\n")
-        sys.exit(1)
+    def submit(self, job, block=True, on_start=None):
+        """Queues a job; raises queue.Full when block is False and the queue is full."""
+        future = Future()
+        self.jobs.put((job, future, on_start), block=block)
+        return future
 
-    input_json_path = sys.argv[1]
-    output_path = sys.argv[2]
+    def stop(self):
+        self.jobs.put(None)
+        self._thread.join()
 
+    def _run(self):
+        while True:
+            item = self.jobs.get()
+            if item is None:
+                return
+            job, future, on_start = item
+            if on_start is not None:
+                on_start()
+            future.set_result(run_export_job(job))
+
+def _parse_job_line(line):
     try:
-        with open(input_json_path, 'r') as f:
-            users_data = json.load(f)
+        job = json.loads(line)
+    except json.JSONDecodeError as e:
+        return None, {'id': None, 'ok': False, 'error': f"Invalid job line: {e.msg}"}
+    if not isinstance(job, dict):
+        return None, {'id': None, 'ok': False, 'error': "Invalid job line: expected an object"}
+    return job, None
 
-    except FileNotFoundError:
+def serve_stdin(queue_size=WORKER_QUEUE_SIZE):
+    """Reads one JSON job per line on stdin and writes one JSON response per line on stdout.
+
+    Responses are written in submission order; reading stops while the queue is full.
+    When a job leaves the queue, a {"id": ..., "started": true} line is written first, so the
+    caller can time the job itself rather than its wait in the queue.
+    """
+    worker = ExportWorker(queue_size)
+    pending = queue.Queue()
+    write_lock = threading.Lock()
+
+    def write_line(message):
+        with write_lock:
+            sys.stdout.write(json.dumps(message) + "\n")
+            sys.stdout.flush()
+
+    def write_responses():
+        while True:
+            future = pending.get()
+            if future is None:
+                return
+            write_line(future.result())
+
+    writer = threading.Thread(target=write_responses, name="export-worker-responses", daemon=True)
+    writer.start()
+
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        job, error = _parse_job_line(line)
+        if error:
+            future = Future()
+            future.set_result(error)
+        else:
+            future = worker.submit(job, on_start=functools.partial(write_line, {'id': job.get('id'), 'started': True}))
+        pending.put(future)
+
+    pending.put(None)
+    writer.join()
+    worker.stop()
+
+def serve_socket(socket_path, queue_size=WORKER_QUEUE_SIZE):
+    """Same line protocol as serve_stdin, over a local Unix socket (one thread per connection).
+
+    When the queue is full the job is rejected immediately with a "busy" error instead of waiting.
+    """
+    worker = ExportWorker(queue_size)
+
+    class JobHandler(socketserver.StreamRequestHandler):
+        def handle(self):
+            for raw_line in self.rfile:
+                line = raw_line.decode('utf-8')
+                if not line.strip():
+                    continue
+                job, response = _parse_job_line(line)
+                if job is not None:
+                    try:
+                        response = worker.submit(job, block=False).result()
+                    except queue.Full:
+                        response = {'id': job.get('id'), 'ok': False, 'error': "busy", 'retry': True}
+                self.wfile.write((json.dumps(response) + "\n").encode('utf-8'))
+                self.wfile.flush()
+
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    with socketserver.ThreadingUnixStreamServer(socket_path, JobHandler) as server:
+        server.daemon_threads = True
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            os.remove(socket_path)
+    worker.stop()
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Export des usagers vers Excel, CSV ou Parquet")
+    arg_parser.add_argument("input_json_path", nargs="?")
+    arg_parser.add_argument("output_path", nargs="?")
+    arg_parser.add_argument("--streaming", action="store_true",
+                            help="Écrit le classeur en mode write-only (mémoire constante)")
+    arg_parser.add_argument("--workers", type=int, default=1,
+                            help="Nombre de processus pour construire les lignes en parallèle")
+    arg_parser.add_argument("--group-by", choices=sorted(GROUP_BY_COLUMNS),
+                            help="Une feuille par antenne, gestionnaire ou secteur, plus une feuille de synthèse")
+    arg_parser.add_argument("--normalize-children", action="store_true",
+                            help="Actions et problématiques dans des feuilles séparées, reliées par l'id de l'usager")
+    arg_parser.add_argument("--format", dest="output_format", choices=EXPORT_FORMATS, default="xlsx",
+                            help="xlsx (classeur stylé), csv (UTF-8 avec BOM) ou parquet (nécessite pyarrow)")
+    arg_parser.add_argument("--csv-delimiter", default=CSV_DELIMITER, help="Séparateur du format csv")
+    arg_parser.add_argument("--columns",
+                            help="Liste de colonnes à exporter, séparées par des virgules (par défaut : toutes)")
+    arg_parser.add_argument("--cache", action="store_true",
+                            help="Réutilise un export identique déjà produit (empreinte des données et des options)")
+    arg_parser.add_argument("--cache-key",
+                            help="Clé de version fournie par l'appelant (évite de hacher les données ; implique --cache)")
+    arg_parser.add_argument("--cache-dir", default=EXPORT_CACHE_DIR, help="Répertoire du cache des exports")
+    arg_parser.add_argument("--cache-max-mb", type=int, default=EXPORT_CACHE_MAX_BYTES // (1024 * 1024),
+                            help="Taille maximale du cache (Mo)")
+    arg_parser.add_argument("--cache-max-age", type=float, default=EXPORT_CACHE_MAX_AGE / 3600,
+                            help="Âge maximal d'un export en cache (heures)")
+    arg_parser.add_argument("--diagnostics", metavar="PATH",
+                            help="Écrit le rapport JSON des dates / JSON illisibles (par champ, type, exemples, usagers)")
+    arg_parser.add_argument("--diagnostics-sheet", action="store_true",
+                            help="Ajoute ce rapport dans une feuille masquée « Diagnostics » du classeur")
+    arg_parser.add_argument("--metrics", metavar="PATH",
+                            help='Écrit un résumé JSON (durée par phase, compteurs, mémoire de pointe) ; "-" pour stderr')
+    arg_parser.add_argument("--profile-out", metavar="PATH",
+                            help="Enregistre un profil cProfile de l'export (lisible avec pstats / snakeviz)")
+    arg_parser.add_argument("--worker", action="store_true",
+                            help="Mode worker persistant : un job JSON par ligne sur stdin, une réponse par ligne sur stdout")
+    arg_parser.add_argument("--socket", metavar="PATH",
+                            help="Avec --worker, écoute sur ce socket Unix au lieu de stdin")
+    arg_parser.add_argument("--queue-size", type=int, default=WORKER_QUEUE_SIZE,
+                            help="Nombre maximal de jobs en attente dans le worker")
+    args = arg_parser.parse_args()
+
+    if args.cache or args.cache_key is not None or args.worker:
+        # En mode worker, ces réglages s'appliquent aux jobs qui demandent le cache
+        get_export_cache(args.cache_dir, args.cache_max_mb * 1024 * 1024, args.cache_max_age * 3600)
+
+    if args.worker:
+        if args.socket:
+            serve_socket(args.socket, args.queue_size)
+        else:
+            serve_stdin(args.queue_size)
+        sys.exit(0)
+
+    if not args.input_json_path or not args.output_path:
+        arg_parser.error("input_json_path and output_path are required outside --worker mode")
+    if args.group_by and args.normalize_children:
+        arg_parser.error("--group-by and --normalize-children cannot be combined")
+
+    input_json_path = args.input_json_path
+    output_path = args.output_path
+
+    use_cache = args.cache or args.cache_key is not None
+    users_data = None
+    if use_cache and not os.path.isfile(input_json_path):
         sys.stderr.write(f"Error: Input JSON file not found at {input_json_path}\n")
         sys.exit(1)
+    if not use_cache:
+        # Avec --cache, le fichier n'est ouvert que pour calculer l'empreinte puis, en cas d'absence, pour l'export
+        try:
+            users_data = read_users_stream(input_json_path)
+        except FileNotFoundError:
+            sys.stderr.write(f"Error: Input JSON file not found at {input_json_path}\n")
+            sys.exit(1)
+        except ValueError as e:
+            sys.stderr.write(f"Error: {e}\n")
+            sys.exit(1)
+        except Exception as ex:
+            sys.stderr.write(f"An unexpected error occurred while reading {input_json_path}: {ex}\n")
+            sys.exit(1)
+
+    # Les usagers sont décodés au fil de l'export : les erreurs JSON surviennent donc pendant l'écriture
+    export_options = {
+        'output_format': args.output_format,
+        'streaming': args.streaming,
+        'group_by': args.group_by,
+        'normalize_children': args.normalize_children,
+        'columns': parse_export_columns(args.columns),
+        'csv_delimiter': args.csv_delimiter,
+        'diagnostics_sheet': args.diagnostics_sheet,
+    }
+    instrumentation = Instrumentation(enabled=bool(args.metrics or args.profile_out), profile_path=args.profile_out)
+    try:
+        with instrumented_run(instrumentation):
+            if use_cache:
+                cache_hit, diagnostics = create_cached_export(input_json_path, output_path, get_export_cache(),
+                                                              args.cache_key, workers=args.workers, **export_options)
+                if cache_hit:
+                    sys.stdout.write("Export served from cache\n")
+            else:
+                diagnostics = create_export(users_data, output_path, workers=args.workers, **export_options)
     except json.JSONDecodeError as e:
         sys.stderr.write(f"Error decoding JSON from {input_json_path}: {e.msg}\n")
         sys.exit(1)
-    except Exception as ex:
-        sys.stderr.write(f"An unexpected error occurred while reading {input_json_path}: {ex}\n")
+    except ValueError as e:
+        sys.stderr.write(f"Error: {e}\n")
         sys.exit(1)
-
-    if not isinstance(users_data, list):
-         sys.stderr.write("Error: Expected a list of users from input JSON file\n")
-         sys.exit(1)
-
-    create_excel_export(users_data, output_path)
-    sys.stdout.write(f"Excel file created successfully at {output_path}\n")
+    if args.output_format == 'xlsx':
+        sys.stdout.write(f"Excel file created successfully at {output_path}\n")
+    else:
+        sys.stdout.write(f"{args.output_format.upper()} file created successfully at {output_path}\n")
+    if diagnostics is not None:
+        # Un seul message pour tout l'export, le détail est dans le rapport
+        if diagnostics.total:
+            sys.stderr.write(diagnostics.summary_line())
+        if args.diagnostics:
+            diagnostics.write(args.diagnostics)
+    if instrumentation.enabled:
+        instrumentation.write_summary(args.metrics or '-', script='export_users_excel', format=args.output_format)
@@ -0,0 +1,197 @@
+# Copyright (C) 2025 ABDEL KADER CHATAR
+# SocialConnect est un logiciel libre : vous pouvez le redistribuer et/ou le modifier selon les termes de la Licence Publique Générale GNU telle que publiée par la Free Software Foundation, soit la version 3 de la licence, soit (à votre convenance) toute version ultérieure.
+#
+# Ce programme est distribué dans l'espoir qu'il sera utile, mais SANS AUCUNE GARANTIE ; sans même la garantie implicite de COMMERCIALISATION ou d'ADÉQUATION À UN USAGE PARTICULIER. Voir la Licence Publique Générale GNU pour plus de détails.
+
+"""Opt-in instrumentation for the export and import scripts.
+
+An Instrumentation records self time per phase (nested phases are subtracted from their
+parent), counters, warnings, peak memory and optionally a cProfile dump, and renders it all
+as one JSON summary. On Linux the peak RSS is reset when the run starts, so a long-lived
+worker reports the peak of each job; elsewhere it is the peak of the whole process
+(peak_rss_scope tells which). When disabled, the wrapping helpers return their argument unchanged,
+so the instrumented code paths cost nothing.
+"""
+
+import cProfile
+import contextlib
+import json
+import sys
+import time
+import warnings
+from collections import Counter
+
+try:
+    import resource
+except ImportError:  # Windows : pas de ru_maxrss, la mémoire de pointe n'est pas rapportée
+    resource = None
+
+# Linux : écrire "5" dans clear_refs remet VmHWM (pic de RSS) à la RSS courante
+CLEAR_REFS_PATH = '/proc/self/clear_refs'
+PROC_STATUS_PATH = '/proc/self/status'
+
+def reset_peak_rss():
+    """Resets the process peak RSS to its current RSS; returns False where that isn't supported."""
+    try:
+        with open(CLEAR_REFS_PATH, 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+def process_peak_rss_mb():
+    """Peak RSS of the current process in MB (since the last reset_peak_rss), None if unknown."""
+    try:
+        with open(PROC_STATUS_PATH) as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss est en Ko sous Linux, en octets sous macOS
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+class Instrumentation:
+    def __init__(self, enabled=True, profile_path=None):
+        self.enabled = enabled
+        self.profile_path = profile_path if enabled else None
+        self.phase_seconds = Counter()
+        self.phase_calls = Counter()
+        self.counters = Counter()
+        self.warnings = Counter()
+        self._stack = []
+        self._profiler = None
+        self._started = None
+        self._elapsed = None
+        self._peak_reset = False
+        self._pool_peak_rss_mb = None
+
+    def __enter__(self):
+        if not self.enabled:
+            return self
+        self._started = time.perf_counter()
+        self._peak_reset = reset_peak_rss()
+        self._warnings_context = warnings.catch_warnings(record=True)
+        self._caught_warnings = self._warnings_context.__enter__()
+        warnings.simplefilter("default")
+        if self.profile_path:
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if not self.enabled:
+            return False
+        if self._profiler:
+            self._profiler.disable()
+            self._profiler.dump_stats(self.profile_path)
+        self._elapsed = time.perf_counter() - self._started
+        self._warnings_context.__exit__(exc_type, exc, tb)
+        # Les avertissements capturés sont comptés puis réémis normalement
+        for caught in self._caught_warnings:
+            self.warnings[caught.category.__name__] += 1
+            warnings.showwarning(caught.message, caught.category, caught.filename, caught.lineno)
+        return False
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Times a block; time spent in phases nested inside it is only counted for them."""
+        if not self.enabled:
+            yield
+            return
+        frame = [time.perf_counter(), 0.0]
+        self._stack.append(frame)
+        try:
+            yield
+        finally:
+            self._stack.pop()
+            total = time.perf_counter() - frame[0]
+            self.phase_seconds[name] += total - frame[1]
+            self.phase_calls[name] += 1
+            if self._stack:
+                self._stack[-1][1] += total
+
+    def timed(self, name, func):
+        """Returns func wrapped in phase(name) (func itself when disabled)."""
+        if not self.enabled:
+            return func
+        def wrapper(*args, **kwargs):
+            with self.phase(name):
+                return func(*args, **kwargs)
+        return wrapper
+
+    def timed_iter(self, name, iterable):
+        """Yields from iterable, timing each step in phase(name) (iterable itself when disabled)."""
+        if not self.enabled:
+            return iterable
+        return self._timed_iter(name, iter(iterable))
+
+    def _timed_iter(self, name, iterator):
+        while True:
+            with self.phase(name):
+                item = next(iterator, _EXHAUSTED)
+            if item is _EXHAUSTED:
+                return
+            yield item
+
+    @contextlib.contextmanager
+    def patched(self, target, attribute, name):
+        """Temporarily times every call of target.attribute (e.g. a shared normalizer's method)."""
+        if not self.enabled:
+            yield
+            return
+        original = getattr(target, attribute)
+        setattr(target, attribute, self.timed(name, original))
+        try:
+            yield
+        finally:
+            setattr(target, attribute, original)
+
+    def count(self, name, amount=1):
+        if self.enabled:
+            self.counters[name] += amount
+
+    def record_pool_peak(self, peak_mb):
+        """Keeps the highest peak RSS reported by a pool process of this run."""
+        if self.enabled and peak_mb is not None:
+            self._pool_peak_rss_mb = max(self._pool_peak_rss_mb or 0.0, peak_mb)
+
+    def summary(self, **extra):
+        """Returns the JSON-serializable summary; extra keys are merged in."""
+        total = self._elapsed if self._elapsed is not None else (
+            time.perf_counter() - self._started if self._started else 0.0)
+        report = {
+            'total_seconds': round(total, 3),
+            'phases': {
+                name: {'seconds': round(seconds, 3), 'calls': self.phase_calls[name]}
+                for name, seconds in self.phase_seconds.most_common()
+            },
+            'counters': dict(self.counters),
+            'warnings': dict(self.warnings),
+            'peak_rss_mb': process_peak_rss_mb(),
+            'peak_rss_scope': 'run' if self._peak_reset else 'process',
+        }
+        if self._pool_peak_rss_mb is not None:
+            report['pool_peak_rss_mb'] = self._pool_peak_rss_mb
+        if self.profile_path:
+            report['profile'] = self.profile_path
+        report.update(extra)
+        return report
+
+    def write_summary(self, path, **extra):
+        """Writes the summary as JSON to path, or as a single line on stderr when path is "-"."""
+        report = self.summary(**extra)
+        if path == '-':
+            sys.stderr.write(json.dumps(report, ensure_ascii=False) + "\n")
+        else:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+        return report
+
+_EXHAUSTED = object()
+
+# Instance désactivée partagée : les scripts la remplacent quand --metrics / --profile est demandé
+DISABLED = Instrumentation(enabled=False)
@@ -0,0 +1,168 @@
+/*
+Copyright (C) 2025 ABDEL KADER CHATAR
+SocialConnect est un logiciel libre : vous pouvez le redistribuer et/ou le modifier selon les termes de la Licence Publique Générale GNU telle que publiée par la Free Software Foundation, soit la version 3 de la licence, soit (à votre convenance) toute version ultérieure.
+
+Ce programme est distribué dans l'espoir qu'il sera utile, mais SANS AUCUNE GARANTIE ; sans même la garantie implicite de COMMERCIALISATION ou d'ADÉQUATION À UN USAGE PARTICULIER. Voir la Licence Publique Générale GNU pour plus de détails.
+*/
+
+/**
+ * Excel Export Worker
+ *
+ * Keeps a single long-lived `python3 src/export_users_excel.py --worker` process
+ * so that exports don't pay interpreter startup and openpyxl/dateutil imports on
+ * every request. Jobs are sent as one JSON line on stdin, responses come back as
+ * one JSON line on stdout. The worker is (re)started lazily if it exits.
+ *
+ * Jobs run one at a time. The worker writes a `{"id", "started": true}` line when a job
+ * leaves its queue, and JOB_TIMEOUT_MS only counts from there (waiting behind other exports
+ * doesn't count). A job that exceeds it would keep the worker busy, so the worker is killed
+ * and the jobs still queued behind it are re-sent to a fresh one.
+ */
+
+import { spawn, ChildProcessWithoutNullStreams } from 'child_process';
+import * as path from 'path';
+import * as readline from 'readline';
+
+// Durée d'exécution maximale d'un job, à partir de son démarrage dans le worker (il est alors redémarré)
+const JOB_TIMEOUT_MS = 5 * 60 * 1000;
+
+export type ExportFormat = 'xlsx' | 'csv' | 'parquet';
+
+export interface ExcelExportJob {
+    input: string;      // Fichier JSON (tableau ou NDJSON) des usagers
+    output: string;     // Chemin du fichier XLSX à produire
+    streaming?: boolean;
+    columns?: string[];  // Sous-ensemble de colonnes (en-têtes), toutes par défaut
+    format?: ExportFormat;
+    cache?: boolean;     // Réutilise un export identique déjà produit (cache du worker)
+    cache_key?: string;  // Clé de version fournie par l'appelant, à la place de l'empreinte des données
+    metrics?: boolean;   // Renvoie le résumé d'instrumentation (durées par phase, compteurs, mémoire)
+    diagnostics_sheet?: boolean;  // Ajoute le rapport des valeurs illisibles dans une feuille masquée
+}
+
+export interface ExportDiagnosticsReport {
+    total: number;
+    by_kind: Record<string, number>;
+    by_field: Record<string, {
+        count: number;
+        kinds: Record<string, number>;
+        samples: string[];
+        usager_ids: string[];
+        usager_ids_truncated: boolean;
+    }>;
+}
+
+export interface ExcelExportJobResult {
+    id: number;
+    ok: boolean;
+    output?: string;
+    error?: string;
+    duration_ms?: number;
+    cache_hit?: boolean;
+    metrics?: Record<string, unknown>;
+    diagnostics?: ExportDiagnosticsReport;
+}
+
+interface PendingJob {
+    worker: ChildProcessWithoutNullStreams;
+    line: string;  // Ligne envoyée sur stdin, renvoyée telle quelle si le worker est remplacé
+    resolve: (result: ExcelExportJobResult) => void;
+    reject: (error: Error) => void;
+    timer: ReturnType<typeof setTimeout> | null;  // Armé à la réception de la ligne "started"
+}
+
+interface JobStartedMessage {
+    id: number;
+    started: true;
+}
+
+let workerProcess: ChildProcessWithoutNullStreams | null = null;
+let nextJobId = 1;
+const pendingJobs = new Map<number, PendingJob>();
+
+function rejectAllPending(worker: ChildProcessWithoutNullStreams, error: Error): void {
+    pendingJobs.forEach((job, id) => {
+        if (job.worker !== worker) return;
+        if (job.timer) clearTimeout(job.timer);
+        pendingJobs.delete(id);
+        job.reject(error);
+    });
+}
+
+function getWorker(): ChildProcessWithoutNullStreams {
+    if (workerProcess) return workerProcess;
+
+    const scriptPath = path.join(process.cwd(), 'src', 'export_users_excel.py');
+    const child = spawn('python3', [scriptPath, '--worker'], { cwd: process.cwd() });
+
+    readline.createInterface({ input: child.stdout }).on('line', line => {
+        let message: ExcelExportJobResult | JobStartedMessage;
+        try {
+            message = JSON.parse(line);
+        } catch {
+            console.error('[Excel Worker] Réponse illisible du worker:', line);
+            return;
+        }
+        const job = pendingJobs.get(message.id);
+        if (!job || job.worker !== child) return;
+        if ('started' in message) {
+            startJobTimer(message.id, job);
+            return;
+        }
+        if (job.timer) clearTimeout(job.timer);
+        pendingJobs.delete(message.id);
+        job.resolve(message);
+    });
+
+    child.stderr.on('data', (chunk: Buffer) => {
+        console.warn(`[Excel Worker] ${chunk.toString().trimEnd()}`);
+    });
+
+    const onExit = (reason: string) => {
+        if (workerProcess === child) workerProcess = null;
+        rejectAllPending(child, new Error(`Le worker Excel s'est arrêté (${reason})`));
+    };
+    child.on('exit', code => onExit(`code ${code}`));
+    child.on('error', err => onExit(err.message));
+    // Écriture vers un worker déjà mort (EPIPE) : sans ce handler, l'erreur ferait tomber le process Next.js
+    child.stdin.on('error', err => {
+        console.error('[Excel Worker] Écriture impossible vers le worker:', err.message);
+        onExit(err.message);
+    });
+
+    workerProcess = child;
+    return child;
+}
+
+function startJobTimer(id: number, job: PendingJob): void {
+    job.timer = setTimeout(() => {
+        pendingJobs.delete(id);
+        job.reject(new Error(`Le job d'export ${id} a dépassé ${JOB_TIMEOUT_MS / 1000}s`));
+        // Le worker est toujours occupé par ce job : on le remplace pour ne pas bloquer les exports suivants
+        const stuck = job.worker;
+        if (workerProcess === stuck) workerProcess = null;
+        stuck.kill();
+        // Les jobs en file derrière lui n'ont pas démarré : ils passent au nouveau worker, dans le même ordre
+        const queued = Array.from(pendingJobs.values()).filter(pending => pending.worker === stuck);
+        if (queued.length === 0) return;
+        const next = getWorker();
+        for (const pending of queued) {
+            pending.worker = next;
+            next.stdin.write(pending.line);
+        }
+    }, JOB_TIMEOUT_MS);
+}
+
+/**
+ * Sends an export job to the persistent worker and resolves with its response.
+ */
+export function runExcelExportJob(job: ExcelExportJob): Promise<ExcelExportJobResult> {
+    const worker = getWorker();
+    const id = nextJobId++;
+    const line = JSON.stringify({ id, streaming: true, ...job }) + '\n';
+
+    return new Promise((resolve, reject) => {
+        pendingJobs.set(id, { worker, line, resolve, reject, timer: null });
+        worker.stdin.write(line);
+    });
+}
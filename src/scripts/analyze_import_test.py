@@ -1,6 +1,21 @@
 import pandas as pd
 import sys
 import os
+import argparse
+import datetime
+import difflib
+import functools
+import hashlib
+import heapq
+import json
+import re
+import time
+from collections import Counter
+
+import openpyxl
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from mediation_listing import HEADER_ROW, dedupe_headers, normalize_cell, normalize_name  # noqa: E402
 
 def analyze_excel(file_path):
     print(f"--- ANALYSE DU FICHIER : {os.path.basename(file_path)} ---")
@@ -40,10 +55,257 @@ def analyze_excel(file_path):
     except Exception as e:
         print(f"\n❌ ERREUR CRITIQUE : Impossible de lire le fichier.\n{e}")
 
+# Mode profilage : nombre de lignes lues par défaut (0 = tout le fichier)
+PROFILE_SAMPLE_ROWS = 5000
+# Au-delà, le nombre de valeurs distinctes est estimé (k plus petites empreintes)
+EXACT_DISTINCT_LIMIT = 5000
+DISTINCT_SKETCH_SIZE = 1024
+SAMPLE_VALUES = 5
+
+# Colonnes lues par process_mediation_file (en-têtes exacts, espaces compris) -> champ produit
+MEDIATION_FIELDS = {
+    'Nom': 'nom',
+    'Prénom': 'prenom',
+    'Genre': 'genre',
+    'N°de téléphone': 'telephone',
+    'Adresse mail': 'email',
+    "Tranche d'âge": 'trancheAge',
+    "Date d'ouverture ": 'dateOuverture',
+    'Date de reception ': 'dateOuverture (repli)',
+    'Date de clôture': 'dateCloture',
+    'Adresse': 'adresse.rue',
+    'N°': 'adresse.numero',
+    'Titulaire ': 'gestionnaire',
+    'Secteur': 'secteur',
+    'Type de conflit': 'remarques',
+    'Issue': 'remarques',
+    'Statut': 'remarques',
+}
+
+TEXT_DATE_FORMATS = [
+    (re.compile(r"^\d{4}-\d{2}-\d{2}([T ]\d{2}:\d{2}(:\d{2})?)?$"), 'AAAA-MM-JJ'),
+    (re.compile(r"^\d{1,2}/\d{1,2}/\d{4}$"), 'JJ/MM/AAAA'),
+    (re.compile(r"^\d{1,2}/\d{1,2}/\d{2}$"), 'JJ/MM/AA'),
+    (re.compile(r"^\d{1,2}-\d{1,2}-\d{4}$"), 'JJ-MM-AAAA'),
+    (re.compile(r"^\d{1,2}\.\d{1,2}\.\d{4}$"), 'JJ.MM.AAAA'),
+]
+NUMBER_PATTERN = re.compile(r"^-?\d+([.,]\d+)?$")
+
+@functools.lru_cache(maxsize=65536)
+def _classify_text(value):
+    """Returns (kind, date format) for a stripped text cell; listings repeat the same values a lot."""
+    for pattern, label in TEXT_DATE_FORMATS:
+        if pattern.match(value):
+            return 'date (texte)', label
+    if NUMBER_PATTERN.match(value):
+        return 'nombre (texte)', None
+    return 'texte', None
+
+class DistinctCounter:
+    """Counts distinct values exactly up to EXACT_DISTINCT_LIMIT, then estimates them.
+
+    The estimate keeps the k smallest 64-bit hashes seen (KMV sketch): with k hashes,
+    distinct ~ (k - 1) / (largest kept hash / 2**64).
+    """
+
+    def __init__(self, exact_limit=EXACT_DISTINCT_LIMIT, sketch_size=DISTINCT_SKETCH_SIZE):
+        self.exact_limit = exact_limit
+        self.sketch_size = sketch_size
+        self.values = set()
+        self.sketch = None  # tas max (valeurs négatives) des plus petites empreintes
+        self.in_sketch = set()
+
+    @staticmethod
+    def _hash(value):
+        return int.from_bytes(hashlib.blake2b(repr(value).encode('utf-8'), digest_size=8).digest(), 'big')
+
+    def add(self, value):
+        if self.sketch is None:
+            self.values.add(value)
+            if len(self.values) > self.exact_limit:
+                self.sketch, self.in_sketch = [], set()
+                for known in self.values:
+                    self._add_hash(self._hash(known))
+                self.values = None
+            return
+        self._add_hash(self._hash(value))
+
+    def _add_hash(self, hashed):
+        if hashed in self.in_sketch:
+            return
+        if len(self.sketch) < self.sketch_size:
+            heapq.heappush(self.sketch, -hashed)
+            self.in_sketch.add(hashed)
+        elif hashed < -self.sketch[0]:
+            self.in_sketch.discard(-heapq.heappushpop(self.sketch, -hashed))
+            self.in_sketch.add(hashed)
+
+    def result(self):
+        """Returns (count, approximate)."""
+        if self.sketch is None:
+            return len(self.values), False
+        if len(self.sketch) < self.sketch_size:
+            return len(self.sketch), False
+        return int((self.sketch_size - 1) / (-self.sketch[0] / 2 ** 64)), True
+
+class ColumnProfile:
+    def __init__(self, name):
+        self.name = name
+        self.nulls = 0
+        self.types = Counter()
+        self.date_formats = Counter()
+        self.distinct = DistinctCounter()
+        self.samples = []
+
+    def add(self, value):
+        if value is None:
+            self.nulls += 1
+            return
+        if isinstance(value, datetime.datetime):
+            kind = 'date'
+            self.date_formats['excel (date)' if value.time() == datetime.time() else 'excel (date+heure)'] += 1
+        elif isinstance(value, (datetime.date, datetime.time)):
+            kind = 'date'
+            self.date_formats[f"excel ({type(value).__name__})"] += 1
+        elif isinstance(value, bool):
+            kind = 'booléen'
+        elif isinstance(value, int):
+            kind = 'entier'
+        elif isinstance(value, float):
+            kind = 'décimal'
+        else:
+            value = str(value).strip()
+            kind, date_format = _classify_text(value)
+            if date_format:
+                self.date_formats[date_format] += 1
+        self.types[kind] += 1
+        self.distinct.add(value)
+        if len(self.samples) < SAMPLE_VALUES and value not in self.samples:
+            self.samples.append(value)
+
+    def report(self, rows):
+        distinct, approximate = self.distinct.result()
+        filled = rows - self.nulls
+        return {
+            'colonne': self.name,
+            'taux_vide': round(self.nulls / rows, 4) if rows else 0.0,
+            'valeurs_distinctes': distinct,
+            'distinct_approximatif': approximate,
+            'type_infere': self.types.most_common(1)[0][0] if self.types else 'vide',
+            'types': {kind: round(count / filled, 4) for kind, count in self.types.most_common()} if filled else {},
+            'formats_date': dict(self.date_formats.most_common()),
+            'echantillon': [value.isoformat() if hasattr(value, 'isoformat') else value for value in self.samples],
+        }
+
+def suggest_column_mapping(headers):
+    """Matches the expected mediation headers against the file's, exactly or by closest name."""
+    by_normalized = {}
+    for header in headers:
+        by_normalized.setdefault(normalize_name(header), header)
+    mapping = []
+    for expected, field in MEDIATION_FIELDS.items():
+        if expected in headers:
+            mapping.append({'champ': field, 'attendu': expected, 'colonne': expected, 'confiance': 1.0})
+            continue
+        normalized = normalize_name(expected)
+        if normalized in by_normalized:
+            # Même nom à la casse, aux accents ou aux espaces près : à renommer pour l'import
+            mapping.append({'champ': field, 'attendu': expected, 'colonne': by_normalized[normalized], 'confiance': 0.9})
+            continue
+        close = difflib.get_close_matches(normalized, list(by_normalized), n=1, cutoff=0.75)
+        if close:
+            score = difflib.SequenceMatcher(None, normalized, close[0]).ratio()
+            mapping.append({'champ': field, 'attendu': expected, 'colonne': by_normalized[close[0]],
+                            'confiance': round(score * 0.9, 2)})
+        else:
+            mapping.append({'champ': field, 'attendu': expected, 'colonne': None, 'confiance': 0.0})
+    return mapping
+
+def profile_excel(file_path, sample_rows=PROFILE_SAMPLE_ROWS):
+    """Streams the first sheet (read-only) and returns the profile report as a dict.
+
+    Only the first sample_rows data rows are read (0 reads the whole sheet).
+    """
+    started = time.perf_counter()
+    workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        sheet = workbook.worksheets[0]
+        rows = sheet.iter_rows(values_only=True)
+        for _ in range(HEADER_ROW - 1):
+            next(rows, None)
+        headers = dedupe_headers(next(rows, ()))
+        width = len(headers)
+        profiles = [ColumnProfile(header) for header in headers]
+
+        profiled, truncated = 0, False
+        for row in rows:
+            values = [normalize_cell(value) for value in row[:width]]
+            if not any(value is not None for value in values):
+                continue  # ligne vide, ignorée comme à l'import
+            if sample_rows and profiled >= sample_rows:
+                truncated = True
+                break
+            values.extend([None] * (width - len(values)))
+            for profile, value in zip(profiles, values):
+                profile.add(value)
+            profiled += 1
+        sheet_title, declared_rows = sheet.title, sheet.max_row
+    finally:
+        workbook.close()
+
+    return {
+        'fichier': os.path.basename(file_path),
+        'feuille': sheet_title,
+        'lignes_declarees': declared_rows,
+        'lignes_profilees': profiled,
+        'echantillon': truncated,
+        'duree_s': round(time.perf_counter() - started, 3),
+        'colonnes': [profile.report(profiled) for profile in profiles],
+        'correspondance': suggest_column_mapping(headers),
+    }
+
+def print_profile(report):
+    print(f"--- PROFIL DU FICHIER : {report['fichier']} (feuille {report['feuille']}) ---")
+    sample_note = " (échantillon)" if report['echantillon'] else ""
+    print(f"\n✅ {report['lignes_profilees']} lignes profilées{sample_note} en {report['duree_s']:.2f}s")
+
+    print("\n📋 1. COLONNES :")
+    for i, column in enumerate(report['colonnes']):
+        distinct = f"~{column['valeurs_distinctes']}" if column['distinct_approximatif'] else column['valeurs_distinctes']
+        formats = f", formats : {column['formats_date']}" if column['formats_date'] else ""
+        print(f"   [{i}] {column['colonne']!r} : {column['type_infere']}, "
+              f"{column['taux_vide']:.0%} vide, {distinct} distinctes{formats}")
+
+    print("\n🧭 2. CORRESPONDANCE AVEC L'IMPORT MÉDIATION :")
+    for entry in report['correspondance']:
+        if entry['colonne'] is None:
+            print(f"   ❌ {entry['champ']} : colonne {entry['attendu']!r} introuvable")
+        elif entry['confiance'] < 1.0:
+            print(f"   ⚠️  {entry['champ']} : {entry['colonne']!r} (attendu {entry['attendu']!r}, confiance {entry['confiance']})")
+        else:
+            print(f"   ✅ {entry['champ']} : {entry['colonne']!r}")
+
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("Usage: python analyze_import_test.py <path_to_excel>")
-        sys.exit(1)
+    arg_parser = argparse.ArgumentParser(description="Analyse d'un listing Excel avant import")
+    arg_parser.add_argument("file_path", help="Fichier Excel à analyser")
+    arg_parser.add_argument("--profile", action="store_true",
+                            help="Profil rapide en flux : taux de vide, cardinalité, types, formats de date")
+    arg_parser.add_argument("--sample", type=int, default=PROFILE_SAMPLE_ROWS,
+                            help="Nombre de lignes profilées (0 = tout le fichier)")
+    arg_parser.add_argument("--json", dest="json_path", help="Écrit le profil au format JSON (implique --profile)")
+    args = arg_parser.parse_args()
+
+    if not (args.profile or args.json_path):
+        analyze_excel(args.file_path)
+        sys.exit(0)
 
-    file_path = sys.argv[1]
-    analyze_excel(file_path)
+    try:
+        profile_report = profile_excel(args.file_path, args.sample)
+    except Exception as e:
+        print(f"\n❌ ERREUR CRITIQUE : Impossible de lire le fichier.\n{e}")
+        sys.exit(1)
+    print_profile(profile_report)
+    if args.json_path:
+        with open(args.json_path, 'w', encoding='utf-8') as f:
+            json.dump(profile_report, f, ensure_ascii=False, indent=2, default=str)
+        print(f"\n💾 Profil sauvegardé : {args.json_path}")
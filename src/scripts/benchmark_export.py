@@ -0,0 +1,101 @@
+# Copyright (C) 2025 ABDEL KADER CHATAR
+# SocialConnect est un logiciel libre : vous pouvez le redistribuer et/ou le modifier selon les termes de la Licence Publique Générale GNU telle que publiée par la Free Software Foundation, soit la version 3 de la licence, soit (à votre convenance) toute version ultérieure.
+#
+# Ce programme est distribué dans l'espoir qu'il sera utile, mais SANS AUCUNE GARANTIE ; sans même la garantie implicite de COMMERCIALISATION ou d'ADÉQUATION À UN USAGE PARTICULIER. Voir la Licence Publique Générale GNU pour plus de détails.
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+import json
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from export_users_excel import create_excel_export, iter_user_rows  # noqa: E402
+
+NOMS = ["Dupont", "Martin", "El Amrani", "Popescu", "Janssens", "Diallo", "Peeters", "Benali", "Nowak", "Da Silva"]
+PRENOMS = ["Marie", "Mohamed", "Petrica", "Fatima", "Jan", "Aïcha", "Louis", "Elena", "Youssef", "Sofia"]
+RUES = ["Rue de Fiennes", "Chaussée de Mons", "Rue Wayez", "Boulevard de la Révision", "Rue Clemenceau"]
+ANTENNES = ["Antenne Cureghem", "Antenne Centre", "Antenne Nord", "Antenne Sud"]
+PROBLEMATIQUES = ["Logement", "Énergie", "Dettes", "Santé", "Administratif"]
+ACTIONS = ["RDV", "Appel", "Visite à domicile", "Courrier", "Orientation"]
+
+def _iso_date(rng, start_year=1950, end_year=2025):
+    return f"{rng.randint(start_year, end_year)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}T00:00:00.000Z"
+
+def generate_usager(rng, index):
+    """Builds one synthetic usager with the shape produced by the export route."""
+    logement = {
+        "typeLogement": rng.choice(["Privé", "Social", "AIS", ""]),
+        "dateEntree": _iso_date(rng, 2000),
+        "dateSortie": "",
+        "proprietaire": rng.choice(NOMS),
+        "loyer": str(rng.randint(350, 1200)),
+        "charges": str(rng.randint(0, 200)),
+        "commentaire": "Humidité signalée dans la chambre" if rng.random() < 0.3 else "",
+    }
+    return {
+        "id": f"AND-{index:06d}",
+        "nom": rng.choice(NOMS),
+        "prenom": rng.choice(PRENOMS),
+        "dateNaissance": _iso_date(rng),
+        "genre": rng.choice(["homme", "femme"]),
+        "telephone": f"04{rng.randint(10, 99)}/{rng.randint(100000, 999999)}",
+        "email": f"usager{index}@example.org" if rng.random() < 0.5 else "",
+        "adresse": {"rue": rng.choice(RUES), "numero": str(rng.randint(1, 250)), "boite": "",
+                    "codePostal": "1070", "ville": "Anderlecht"},
+        "dateOuverture": _iso_date(rng, 2020),
+        "dateCloture": _iso_date(rng, 2024) if rng.random() < 0.2 else None,
+        "etat": rng.choice(["Actif", "Clôturé"]),
+        "antenne": rng.choice(ANTENNES),
+        "secteur": "Cureghem",
+        "gestionnaire": {"prenom": rng.choice(PRENOMS), "nom": rng.choice(NOMS)},
+        "notesGenerales": "Suivi régulier, dossier en cours de traitement. " * rng.randint(0, 3),
+        "hasPrevExp": rng.random() < 0.1,
+        "prevExpDateReception": _iso_date(rng, 2023) if rng.random() < 0.1 else None,
+        # logementDetails existe en base sous forme de chaîne JSON ou d'objet
+        "logementDetails": json.dumps(logement) if rng.random() < 0.5 else logement,
+        "problematiques": [{"type": rng.choice(PROBLEMATIQUES), "description": "Situation à suivre"}
+                           for _ in range(rng.randint(0, 3))],
+        "actions": [{"date": _iso_date(rng, 2024), "type": rng.choice(ACTIONS), "description": "Entretien"}
+                    for _ in range(rng.randint(0, 6))],
+    }
+
+def generate_usagers(count, seed=42):
+    rng = random.Random(seed)
+    return [generate_usager(rng, index) for index in range(count)]
+
+def run_benchmark(count, worker_counts, full_export):
+    print(f"🧪 Génération de {count} usagers synthétiques...")
+    users = generate_usagers(count)
+
+    print("\n📊 Construction des lignes (iter_user_rows) :")
+    baseline = None
+    for workers in worker_counts:
+        started = time.perf_counter()
+        row_count = sum(1 for _ in iter_user_rows(users, workers))
+        elapsed = time.perf_counter() - started
+        baseline = baseline or elapsed
+        print(f"   - {workers} worker(s) : {elapsed:.2f}s, {row_count / elapsed:,.0f} lignes/s, x{baseline / elapsed:.2f}")
+
+    if full_export:
+        print("\n📊 Export XLSX complet (mode streaming) :")
+        baseline = None
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for workers in worker_counts:
+                output_path = os.path.join(tmp_dir, f"bench_{workers}.xlsx")
+                started = time.perf_counter()
+                create_excel_export(users, output_path, streaming=True, workers=workers)
+                elapsed = time.perf_counter() - started
+                baseline = baseline or elapsed
+                print(f"   - {workers} worker(s) : {elapsed:.2f}s, {count / elapsed:,.0f} usagers/s, x{baseline / elapsed:.2f}")
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Benchmark de l'export Excel des usagers")
+    arg_parser.add_argument("--count", type=int, default=50000, help="Nombre d'usagers synthétiques")
+    arg_parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4], help="Nombres de workers à comparer")
+    arg_parser.add_argument("--rows-only", action="store_true", help="Ne mesure que la construction des lignes")
+    args = arg_parser.parse_args()
+
+    run_benchmark(args.count, args.workers, not args.rows_only)
@@ -0,0 +1,260 @@
+# Copyright (C) 2025 ABDEL KADER CHATAR
+# SocialConnect est un logiciel libre : vous pouvez le redistribuer et/ou le modifier selon les termes de la Licence Publique Générale GNU telle que publiée par la Free Software Foundation, soit la version 3 de la licence, soit (à votre convenance) toute version ultérieure.
+#
+# Ce programme est distribué dans l'espoir qu'il sera utile, mais SANS AUCUNE GARANTIE ; sans même la garantie implicite de COMMERCIALISATION ou d'ADÉQUATION À UN USAGE PARTICULIER. Voir la Licence Publique Générale GNU pour plus de détails.
+
+"""Benchmark suite for the export (export_users_excel.py) and import (process_mediation_import.py) hot paths.
+
+Each scenario runs in its own Python process so that the reported peak RSS belongs to
+that scenario only. Datasets are synthetic and generated at the requested scales.
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(SCRIPTS_DIR, '..'))
+sys.path.insert(0, SCRIPTS_DIR)
+
+from benchmark_export import NOMS, PRENOMS, RUES, generate_usager  # noqa: E402
+
+DEFAULT_SCALES = [1000, 10000, 100000]
+SCENARIOS = ['export', 'export-legacy', 'import', 'import-streaming']
+
+# En-têtes du listing Médiation (ligne 2 du classeur, dans l'ordre du fichier réel)
+MEDIATION_HEADERS = [
+    "N° de dossier", "Nom", "Prénom", "Genre", "Tranche d'âge", "Adresse", "N°", "Secteur",
+    "N°de téléphone", "Adresse mail", "Titulaire ", "Date de reception ", "Date d'ouverture ",
+    "Delai de traitement", "Date de clôture", "Type de conflit", "Autre type de conflit",
+    "Envoyeur", "Autres", "Partenaire", "Autres", "Type de médiation", "Orientation", "Autres",
+    "Statut", "Issue",
+]
+
+def write_usagers_json(path, count, seed=42):
+    """Writes count synthetic usagers as a JSON array, one record at a time."""
+    rng = random.Random(seed)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('[')
+        for index in range(count):
+            if index:
+                f.write(',')
+            json.dump(generate_usager(rng, index), f, ensure_ascii=False)
+        f.write(']')
+
+def write_mediation_workbook(path, count, seed=42):
+    """Writes a synthetic mediation listing (title row, headers on row 2) with count rows."""
+    import datetime
+    import openpyxl
+
+    rng = random.Random(seed)
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet("Listing")
+    sheet.append(["Listing Médiation locale (synthétique)"])
+    sheet.append(MEDIATION_HEADERS)
+    for index in range(count):
+        received = datetime.datetime(2025, rng.randint(1, 12), rng.randint(1, 28))
+        opened = received + datetime.timedelta(days=rng.randint(0, 10)) if rng.random() < 0.9 else None
+        closed = opened + datetime.timedelta(days=rng.randint(1, 200)) if opened and rng.random() < 0.4 else None
+        # Numéro : entier ou chaîne ("2/164") comme dans le fichier réel
+        numero = rng.randint(1, 250) if rng.random() < 0.8 else f"{rng.randint(1, 9)}/{rng.randint(1, 250)}"
+        sheet.append([
+            index + 1, rng.choice(NOMS), rng.choice(PRENOMS), rng.choice(["Homme", "Femme"]),
+            rng.choice(["18 - 30 ans", "30 - 50 ans", "50 - 65 ans", "+ 65 ans"]),
+            rng.choice(RUES), numero, "Cureghem",
+            f"04{rng.randint(10, 99)}/{rng.randint(100000, 999999)}",
+            f"usager{index}@example.org" if rng.random() < 0.5 else None,
+            rng.choice(["Louise", "Pascal", "Souaad "]), received, opened, None, closed,
+            rng.choice(["Conflits de voisinage", "Conflits Locatifs", "Copropriété", None]), None,
+            rng.choice(["Demande spontanée", "Déjà venu", None]), None, None, None,
+            "Individuelle", None, None,
+            rng.choice(["Clôturé", "En cours", None]), rng.choice(["Apaisement", "Réorientation", None]),
+        ])
+    workbook.save(path)
+
+def write_edge_case_workbook(path):
+    """Writes a small listing whose cleaned columns hold no text: integer N° with a blank,
+    numeric telephone, empty Genre/Adresse mail columns and a boolean Statut, plus an empty
+    row in the middle (read_excel then reads every numeric column as float)."""
+    import datetime
+    import openpyxl
+
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    sheet.append(["Listing Médiation locale (cas limites)"])
+    sheet.append(MEDIATION_HEADERS)
+    for index in range(6):
+        row = dict.fromkeys(MEDIATION_HEADERS)
+        row.update({
+            "N° de dossier": index + 1, "Nom": f" {NOMS[index]} ", "Prénom": PRENOMS[index],
+            "Adresse": RUES[index % len(RUES)], "N°": None if index == 3 else 12 + index, "Secteur": "Cureghem",
+            "N°de téléphone": 470000000 + index, "Titulaire ": "Louise",
+            "Date de reception ": datetime.datetime(2025, 1, index + 1), "Statut": bool(index % 2),
+        })
+        sheet.append([row[header] for header in MEDIATION_HEADERS])
+        if index == 1:
+            sheet.append([None])
+    workbook.save(path)
+
+def reference_mediation_records(input_path):
+    """Row-by-row conversion of the original process_mediation_file loop, used as the expected output."""
+    import pandas as pd
+    from process_mediation_import import clean_value, format_date
+
+    records = []
+    for _, row in pd.read_excel(input_path, header=1).iterrows():
+        if pd.isna(row.get('Nom')) and pd.isna(row.get('Prénom')):
+            continue
+        user = {
+            'nom': clean_value(row.get('Nom')), 'prenom': clean_value(row.get('Prénom')),
+            'genre': clean_value(row.get('Genre')), 'telephone': clean_value(row.get('N°de téléphone')),
+            'email': clean_value(row.get('Adresse mail')), 'nationalite': None,
+            'trancheAge': clean_value(row.get("Tranche d'âge")),
+            'dateOuverture': format_date(row.get("Date d'ouverture ")),
+            'dateCloture': format_date(row.get("Date de clôture")),
+        }
+        if not user['dateOuverture']:
+            user['dateOuverture'] = format_date(row.get("Date de reception "))
+        rue, numero = clean_value(row.get('Adresse')), clean_value(row.get('N°'))
+        if rue:
+            user['adresse'] = {'rue': rue, 'ville': 'Anderlecht', 'codePostal': '1070'}
+            if numero:
+                user['adresse'] = {'rue': rue, 'numero': str(numero), 'ville': 'Anderlecht', 'codePostal': '1070'}
+        user['gestionnaire'] = clean_value(row.get('Titulaire '))
+        user['secteur'] = clean_value(row.get('Secteur'))
+        remarques = [f"{label}: {value}" for label, value in [
+            ("Conflit", clean_value(row.get('Type de conflit'))), ("Issue", clean_value(row.get('Issue'))),
+            ("Statut Import", clean_value(row.get('Statut')))] if value]
+        if remarques:
+            user['remarques'] = " | ".join(remarques)
+        user['annee'] = 2025
+        records.append(user)
+    return records
+
+def check_import_conversion():
+    """Compares the vectorized and streaming imports with the row-by-row reference on the edge-case listing.
+
+    Returns the list of mismatches (empty when the outputs are identical).
+    """
+    from process_mediation_import import process_mediation_file
+
+    failures = []
+    with tempfile.TemporaryDirectory(prefix='check_import_') as work_dir:
+        xlsx_path = os.path.join(work_dir, 'cas_limites.xlsx')
+        write_edge_case_workbook(xlsx_path)
+        expected = json.loads(json.dumps(reference_mediation_records(xlsx_path), ensure_ascii=False))
+        for mode, streaming in [('pandas', False), ('streaming', True)]:
+            output_path = os.path.join(work_dir, f'{mode}.json')
+            try:
+                with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                    process_mediation_file(xlsx_path, output_path, streaming=streaming)
+            except SystemExit:
+                failures.append(f"{mode} : échec de la conversion")
+                continue
+            with open(output_path, encoding='utf-8') as f:
+                actual = json.load(f)
+            if actual != expected:
+                failures.append(f"{mode} : sortie différente de la conversion de référence")
+    return failures
+
+def _peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss est en octets sur macOS, en kilo-octets sur Linux
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+def run_scenario(scenario, input_path):
+    """Runs one scenario in the current process and returns its measurements."""
+    output_dir = tempfile.mkdtemp(prefix='bench_')
+    if scenario in ('export', 'export-legacy'):
+        from export_users_excel import create_excel_export, read_users_stream, DATE_NORMALIZER
+        output_path = os.path.join(output_dir, 'export.xlsx')
+        started = time.perf_counter()
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stderr(devnull):
+            create_excel_export(read_users_stream(input_path), output_path, streaming=(scenario == 'export'))
+        elapsed = time.perf_counter() - started
+        extra = {'date_paths': DATE_NORMALIZER.stats()}
+    else:
+        from process_mediation_import import process_mediation_file
+        output_path = os.path.join(output_dir, 'import.json')
+        started = time.perf_counter()
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            process_mediation_file(input_path, output_path, streaming=(scenario == 'import-streaming'))
+        elapsed = time.perf_counter() - started
+        extra = {}
+
+    result = {
+        'scenario': scenario,
+        'wall_s': round(elapsed, 3),
+        'peak_rss_mb': round(_peak_rss_mb(), 1),
+        'output_bytes': os.path.getsize(output_path),
+        **extra,
+    }
+    os.remove(output_path)
+    os.rmdir(output_dir)
+    return result
+
+def run_suite(scales, scenarios):
+    results = []
+    with tempfile.TemporaryDirectory(prefix='bench_data_') as data_dir:
+        for count in scales:
+            print(f"🧪 Génération des jeux de données synthétiques ({count} usagers)...")
+            json_path = os.path.join(data_dir, f"usagers_{count}.json")
+            xlsx_path = os.path.join(data_dir, f"mediation_{count}.xlsx")
+            if any(scenario.startswith('export') for scenario in scenarios):
+                write_usagers_json(json_path, count)
+            if any(scenario.startswith('import') for scenario in scenarios):
+                write_mediation_workbook(xlsx_path, count)
+
+            for scenario in scenarios:
+                input_path = xlsx_path if scenario.startswith('import') else json_path
+                completed = subprocess.run(
+                    [sys.executable, os.path.abspath(__file__), '--run-scenario', scenario, '--input', input_path],
+                    capture_output=True, text=True,
+                )
+                if completed.returncode != 0:
+                    print(f"   ❌ {scenario} @ {count} : {completed.stderr.strip().splitlines()[-1:]}")
+                    continue
+                result = json.loads(completed.stdout.strip().splitlines()[-1])
+                result['count'] = count
+                result['rows_per_s'] = round(count / result['wall_s']) if result['wall_s'] else None
+                results.append(result)
+                print(f"   - {scenario:<16} {count:>7} lignes : {result['wall_s']:>8.2f}s, "
+                      f"{result['rows_per_s']:>8,} lignes/s, pic RSS {result['peak_rss_mb']:>7.1f} Mo")
+    return results
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Benchmark des scripts d'export et d'import")
+    arg_parser.add_argument("--scales", type=int, nargs="+", default=DEFAULT_SCALES,
+                            help="Tailles des jeux de données synthétiques")
+    arg_parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=SCENARIOS)
+    arg_parser.add_argument("--json", metavar="PATH", help="Écrit aussi les résultats dans ce fichier JSON")
+    arg_parser.add_argument("--check", action="store_true",
+                            help="Vérifie seulement la conversion de l'import sur un listing de cas limites (sans mesure)")
+    # Usage interne : exécution d'un scénario isolé dans un processus enfant
+    arg_parser.add_argument("--run-scenario", choices=SCENARIOS, help=argparse.SUPPRESS)
+    arg_parser.add_argument("--input", help=argparse.SUPPRESS)
+    args = arg_parser.parse_args()
+
+    if args.run_scenario:
+        print(json.dumps(run_scenario(args.run_scenario, args.input)))
+        sys.exit(0)
+
+    if args.check:
+        check_failures = check_import_conversion()
+        for failure in check_failures:
+            print(f"❌ {failure}")
+        print("✅ Conversion identique à la référence" if not check_failures else f"❌ {len(check_failures)} écart(s)")
+        sys.exit(1 if check_failures else 0)
+
+    suite_results = run_suite(args.scales, args.scenarios)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(suite_results, f, ensure_ascii=False, indent=2)
+        print(f"💾 Résultats sauvegardés : {args.json}")
@@ -0,0 +1,247 @@
+# Copyright (C) 2025 ABDEL KADER CHATAR
+# SocialConnect est un logiciel libre : vous pouvez le redistribuer et/ou le modifier selon les termes de la Licence Publique Générale GNU telle que publiée par la Free Software Foundation, soit la version 3 de la licence, soit (à votre convenance) toute version ultérieure.
+#
+# Ce programme est distribué dans l'espoir qu'il sera utile, mais SANS AUCUNE GARANTIE ; sans même la garantie implicite de COMMERCIALISATION ou d'ADÉQUATION À UN USAGE PARTICULIER. Voir la Licence Publique Générale GNU pour plus de détails.
+
+"""Detects duplicate usagers between an existing dataset export and an import batch.
+
+Records are only compared when they share a blocking key (phonetic name, phone digits,
+email, street + number), which keeps the work close to linear instead of comparing every
+pair. Matching pairs are scored, then grouped around a representative record: a record
+only joins a group if it matches that group's representative itself, so groups do not
+chain through intermediate records (A~B, B~C does not put A and C together).
+"""
+
+import argparse
+import difflib
+import itertools
+import json
+import os
+import re
+import sys
+import time
+from collections import Counter, defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from mediation_listing import normalize_name  # noqa: E402
+
+# Au-delà de cette taille, un bloc (ex : un numéro de téléphone générique) n'est pas comparé
+MAX_BLOCK_SIZE = 50
+
+# Poids des indices de similarité (le score est plafonné à 1)
+NAME_WEIGHT = 0.5
+PHONE_WEIGHT = 0.25
+EMAIL_WEIGHT = 0.2
+BIRTHDATE_WEIGHT = 0.15
+ADDRESS_WEIGHT = 0.15
+
+# Un nom identique seul ne suffit pas (homonymes) : il faut au moins un autre indice concordant
+DEFAULT_THRESHOLD = NAME_WEIGHT + min(PHONE_WEIGHT, EMAIL_WEIGHT, BIRTHDATE_WEIGHT, ADDRESS_WEIGHT)
+
+# Règles phonétiques (français), appliquées dans l'ordre sur un nom déjà normalisé
+PHONETIC_RULES = [
+    (r"ph", "f"), (r"qu", "k"), (r"c(?=[eiy])", "s"), (r"ck", "k"), (r"c", "k"),
+    (r"g(?=[eiy])", "j"), (r"gu", "g"), (r"eaux?", "o"), (r"au", "o"), (r"ou", "u"),
+    (r"[ae]i", "e"), (r"y", "i"), (r"h", ""), (r"w", "v"), (r"z", "s"), (r"x", "ks"),
+    (r"(.)\1+", r"\1"), (r"(?<=.)[estdx]$", ""),
+]
+PHONETIC_PATTERNS = [(re.compile(pattern), replacement) for pattern, replacement in PHONETIC_RULES]
+
+def phonetic_key(name):
+    """Returns a phonetic key per token: "Nellio" and "Nelio", "Westerr" and "Wester" share it."""
+    tokens = []
+    for token in normalize_name(name).split():
+        for pattern, replacement in PHONETIC_PATTERNS:
+            token = pattern.sub(replacement, token)
+        if token:
+            tokens.append(token)
+    return " ".join(tokens)
+
+def phone_digits(phone):
+    """Keeps the last 9 digits, so 0455/195601, +32 455 19 56 01 and 0032455195601 match."""
+    digits = re.sub(r"\D", "", str(phone or ""))
+    return digits[-9:] if len(digits) >= 8 else ""
+
+def _address_key(record):
+    adresse = record.get('adresse') if isinstance(record.get('adresse'), dict) else {}
+    rue = normalize_name(adresse.get('rue'))
+    numero = re.match(r"\d+", str(adresse.get('numero') or ""))
+    return f"{rue}|{numero.group()}" if rue and numero else ""
+
+def _birthdate(record):
+    return str(record.get('dateNaissance') or "")[:10]
+
+def prepare_record(record, source, index):
+    """Extracts the normalized fields used for blocking and scoring."""
+    nom, prenom = normalize_name(record.get('nom')), normalize_name(record.get('prenom'))
+    phonetic_nom, phonetic_prenom = phonetic_key(nom), phonetic_key(prenom)
+    return {
+        'ref': f"{source}:{record.get('id') or index}",
+        'source': source,
+        'id': record.get('id'),
+        'nom': record.get('nom'),
+        'prenom': record.get('prenom'),
+        'full_name': f"{nom} {prenom}".strip(),
+        'swapped_name': f"{prenom} {nom}".strip(),
+        'name_chars': Counter(f"{nom} {prenom}".strip()),
+        # Clé de nom indépendante de l'ordre nom/prénom (inversions fréquentes à l'encodage)
+        'name_key': " ".join(sorted(filter(None, [phonetic_nom, phonetic_prenom]))),
+        'phone': phone_digits(record.get('telephone')),
+        'email': (record.get('email') or "").strip().lower(),
+        'address': _address_key(record),
+        'birthdate': _birthdate(record),
+    }
+
+def blocking_keys(prepared):
+    keys = []
+    if prepared['name_key']:
+        keys.append(f"name:{prepared['name_key']}")
+    for field in ('phone', 'email', 'address'):
+        if prepared[field]:
+            keys.append(f"{field}:{prepared[field]}")
+    return keys
+
+def _name_similarity(a, b, floor):
+    """Best ratio between both name orders, or 0 when it cannot reach floor."""
+    if not a['full_name'] or not b['full_name']:
+        return 0.0
+    if a['full_name'] in (b['full_name'], b['swapped_name']):
+        return 1.0
+    # Borne supérieure commune aux deux ordres (même multiset de lettres), comme quick_ratio
+    common = sum((a['name_chars'] & b['name_chars']).values())
+    if 2.0 * common / (len(a['full_name']) + len(b['full_name'])) < floor:
+        return 0.0
+    return max(difflib.SequenceMatcher(None, a['full_name'], other).ratio()
+               for other in (b['full_name'], b['swapped_name']))
+
+def score_pair(a, b, threshold=0.0):
+    """Returns (score, reasons) for two prepared records.
+
+    Pairs that cannot reach threshold even with identical names return early.
+    """
+    reasons = []
+    score = 0.0
+    for field, weight in (('phone', PHONE_WEIGHT), ('email', EMAIL_WEIGHT),
+                          ('birthdate', BIRTHDATE_WEIGHT), ('address', ADDRESS_WEIGHT)):
+        if a[field] and a[field] == b[field]:
+            score += weight
+            reasons.append(field)
+    if score + NAME_WEIGHT < threshold:
+        return score, reasons
+    name_similarity = _name_similarity(a, b, (threshold - score) / NAME_WEIGHT)
+    if name_similarity >= 0.8:
+        reasons.insert(0, f"nom {name_similarity:.2f}")
+    return min(score + NAME_WEIGHT * name_similarity, 1.0), reasons
+
+def find_duplicate_groups(existing_records, import_records, threshold=DEFAULT_THRESHOLD,
+                          max_block_size=MAX_BLOCK_SIZE, import_only=True):
+    """Returns (groups, stats). Each group lists its members and the scored pairs linking them.
+
+    With import_only, only groups containing at least one import record are returned.
+    """
+    prepared = [prepare_record(record, 'existant', i) for i, record in enumerate(existing_records)]
+    prepared += [prepare_record(record, 'import', i) for i, record in enumerate(import_records)]
+
+    blocks = defaultdict(list)
+    for position, record in enumerate(prepared):
+        for key in blocking_keys(record):
+            blocks[key].append(position)
+
+    compared, skipped_blocks = set(), 0
+    matches = []
+    for members in blocks.values():
+        if len(members) < 2:
+            continue
+        if len(members) > max_block_size:
+            skipped_blocks += 1
+            continue
+        for left, right in itertools.combinations(members, 2):
+            if (left, right) in compared:
+                continue
+            compared.add((left, right))
+            score, reasons = score_pair(prepared[left], prepared[right], threshold)
+            if score >= threshold:
+                matches.append((left, right, score, reasons))
+
+    def pair_entry(left, right, score, reasons):
+        return {'a': prepared[left]['ref'], 'b': prepared[right]['ref'], 'score': round(score, 3), 'reasons': reasons}
+
+    # Meilleures paires d'abord : le représentant d'un groupe (de préférence un usager existant)
+    # est fixé à sa création, et tout nouveau membre doit lui correspondre directement
+    group_of = {}
+    grouped = {}
+    for left, right, score, reasons in sorted(matches, key=lambda match: -match[2]):
+        left_group, right_group = group_of.get(left), group_of.get(right)
+        if left_group is None and right_group is None:
+            representative = right if prepared[right]['source'] == 'existant' and prepared[left]['source'] != 'existant' else left
+            grouped[representative] = {'members': {left, right}, 'pairs': [pair_entry(left, right, score, reasons)]}
+            group_of[left] = group_of[right] = representative
+        elif left_group is not None and right_group is not None:
+            if left_group == right_group:
+                grouped[left_group]['pairs'].append(pair_entry(left, right, score, reasons))
+        else:
+            representative = left_group if left_group is not None else right_group
+            newcomer = right if left_group is not None else left
+            if representative not in (left, right):
+                rep_score, rep_reasons = score_pair(prepared[representative], prepared[newcomer], threshold)
+                if rep_score < threshold:
+                    continue
+                grouped[representative]['pairs'].append(pair_entry(representative, newcomer, rep_score, rep_reasons))
+            grouped[representative]['members'].add(newcomer)
+            grouped[representative]['pairs'].append(pair_entry(left, right, score, reasons))
+            group_of[newcomer] = representative
+
+    groups = []
+    for group in grouped.values():
+        members = [prepared[position] for position in sorted(group['members'])]
+        if import_only and not any(member['source'] == 'import' for member in members):
+            continue
+        groups.append({
+            'members': [{key: member[key] for key in ('ref', 'source', 'id', 'nom', 'prenom')} for member in members],
+            'pairs': sorted(group['pairs'], key=lambda pair: -pair['score']),
+        })
+    groups.sort(key=lambda group: -max(pair['score'] for pair in group['pairs']))
+
+    stats = {'records': len(prepared), 'blocks': len(blocks), 'skipped_blocks': skipped_blocks,
+             'comparisons': len(compared), 'matches': len(matches), 'groups': len(groups)}
+    return groups, stats
+
+def load_records(path):
+    """Loads a JSON array (usagers-complets.json, import output) or an NDJSON file."""
+    with open(path, encoding='utf-8') as f:
+        head = f.read(1024).lstrip()
+        f.seek(0)
+        if head.startswith('['):
+            return json.load(f)
+        return [json.loads(line) for line in f if line.strip()]
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Détection des doublons d'usagers par clés de blocage")
+    arg_parser.add_argument("--existing", required=True, help="Export des usagers existants (forme usagers-complets.json)")
+    arg_parser.add_argument("--import", dest="import_path", help="Lot importé (JSON ou NDJSON de process_mediation_import.py)")
+    arg_parser.add_argument("--output", help="Fichier JSON des groupes de doublons")
+    arg_parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                            help=f"Score minimal d'une paire (par défaut {DEFAULT_THRESHOLD:.2f} : nom + un autre indice)")
+    arg_parser.add_argument("--max-block-size", type=int, default=MAX_BLOCK_SIZE)
+    arg_parser.add_argument("--all-groups", action="store_true",
+                            help="Inclut aussi les doublons internes aux usagers existants")
+    args = arg_parser.parse_args()
+
+    started = time.perf_counter()
+    existing = load_records(args.existing)
+    imported = load_records(args.import_path) if args.import_path else []
+    duplicate_groups, dedup_stats = find_duplicate_groups(
+        existing, imported, args.threshold, args.max_block_size,
+        import_only=bool(imported) and not args.all_groups)
+
+    print(f"🔍 {dedup_stats['records']} usagers, {dedup_stats['comparisons']} comparaisons "
+          f"({dedup_stats['blocks']} blocs, {dedup_stats['skipped_blocks']} ignorés), "
+          f"{dedup_stats['groups']} groupes de doublons en {time.perf_counter() - started:.2f}s")
+    for group in duplicate_groups[:10]:
+        names = " / ".join(f"{member['nom']} {member['prenom']} ({member['source']})" for member in group['members'])
+        print(f"   - {group['pairs'][0]['score']:.2f} : {names}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'stats': dedup_stats, 'groups': duplicate_groups}, f, ensure_ascii=False, indent=2)
+        print(f"💾 Groupes sauvegardés : {args.output}")
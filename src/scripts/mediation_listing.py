@@ -0,0 +1,46 @@
+# Copyright (C) 2025 ABDEL KADER CHATAR
+# SocialConnect est un logiciel libre : vous pouvez le redistribuer et/ou le modifier selon les termes de la Licence Publique Générale GNU telle que publiée par la Free Software Foundation, soit la version 3 de la licence, soit (à votre convenance) toute version ultérieure.
+#
+# Ce programme est distribué dans l'espoir qu'il sera utile, mais SANS AUCUNE GARANTIE ; sans même la garantie implicite de COMMERCIALISATION ou d'ADÉQUATION À UN USAGE PARTICULIER. Voir la Licence Publique Générale GNU pour plus de détails.
+
+"""Layout of the mediation listing and the cell / name normalization shared by its scripts.
+
+Standard library only: dedup_usagers.py and the profiler of analyze_import_test.py import
+it without loading pandas, numpy or openpyxl.
+"""
+
+import re
+import unicodedata
+
+# Ligne des en-têtes dans le listing (la 1ère ligne contient les titres de sections)
+HEADER_ROW = 2
+EXCEL_ERROR_VALUES = {'#N/A', '#VALUE!', '#REF!', '#DIV/0!', '#NUM!', '#NAME?', '#NULL!'}
+
+def normalize_name(value):
+    """Folds accents, case and punctuation: " Souaad  EL-Amrani" -> "souaad el amrani"."""
+    if not value:
+        return ""
+    decomposed = unicodedata.normalize('NFKD', str(value))
+    without_accents = "".join(c for c in decomposed if not unicodedata.combining(c))
+    return " ".join(re.sub(r"[^a-z0-9]+", " ", without_accents.lower()).split())
+
+def dedupe_headers(raw_headers):
+    """Names columns like pandas does: "Unnamed: i" for blanks, ".1", ".2" suffixes for duplicates."""
+    headers, seen = [], {}
+    for i, header in enumerate(raw_headers):
+        name = f"Unnamed: {i}" if header is None or header == "" else str(header)
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        else:
+            seen[name] = 0
+        headers.append(name)
+    return headers
+
+def normalize_cell(value):
+    """Applies read_excel's cell conversions: blanks and Excel errors become None, integral floats become int."""
+    if value is None or value == "" or (isinstance(value, str) and value in EXCEL_ERROR_VALUES):
+        return None
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
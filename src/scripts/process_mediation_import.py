@@ -1,8 +1,37 @@
+import argparse
+import contextlib
+import numpy as np
+import openpyxl
 import pandas as pd
 import sys
 import json
 import os
 import datetime
+import glob
+import time
+import difflib
+import hashlib
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from instrumentation import DISABLED as NO_INSTRUMENTATION, Instrumentation  # noqa: E402
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from mediation_listing import HEADER_ROW, dedupe_headers, normalize_cell, normalize_name  # noqa: E402
+
+# Instrumentation active (--metrics / --profile-out) ; désactivée par défaut, voir instrumented_run
+INSTRUMENTATION = NO_INSTRUMENTATION
+
+@contextlib.contextmanager
+def instrumented_run(instrumentation):
+    """Makes instrumentation the active one during the block."""
+    global INSTRUMENTATION
+    previous, INSTRUMENTATION = INSTRUMENTATION, instrumentation
+    try:
+        with instrumentation:
+            yield instrumentation
+    finally:
+        INSTRUMENTATION = previous
 
 def clean_value(val):
     if pd.isna(val):
@@ -19,99 +48,664 @@ def format_date(val):
     # Handle string dates if any? For now assumption is datetime objects
     return str(val)
 
-def process_mediation_file(input_path, output_path):
-    print(f"🔄 Traitement du fichier : {input_path}")
+# Valeurs fixes de l'import Médiation (Anderlecht, année du listing)
+DEFAULT_VILLE = 'Anderlecht'
+DEFAULT_CODE_POSTAL = '1070'
+IMPORT_YEAR = 2025
+# Identifiant du dossier dans le listing, stable d'un export à l'autre (clé du mode incrémental)
+DOSSIER_COLUMN = 'N° de dossier'
+
+def clean_column(df, name):
+    """Column-wise clean_value: strips strings and turns nulls into None (object Series)."""
+    if name not in df.columns:
+        return pd.Series([None] * len(df), index=df.index, dtype=object)
+    # Seules les chaînes sont nettoyées : une colonne sans texte (N° entiers, dates...) n'a pas d'accesseur .str.
+    # Pas de map() : il réinfère le dtype (entiers + vides -> float), différemment d'un lot --streaming à l'autre
+    col = pd.Series([value.strip() if isinstance(value, str) else value for value in df[name].tolist()],
+                    index=df.index, dtype=object)
+    return col.where(col.notna(), None)
+
+def format_date_column(df, name):
+    """Column-wise format_date: ISO strings for datetimes, None for nulls, str() otherwise."""
+    if name not in df.columns:
+        return pd.Series([None] * len(df), index=df.index, dtype=object)
+    # Un listing annuel ne contient que quelques centaines de dates distinctes :
+    # on formate chaque valeur unique une seule fois puis on redistribue via les codes
+    codes, uniques = pd.factorize(df[name])
+    formatted = np.array([None] + [format_date(value) for value in uniques], dtype=object)
+    if INSTRUMENTATION.enabled:
+        # Valeurs qui ne sont pas des dates Excel : recopiées telles quelles par format_date (str)
+        fallback = np.array([False] + [not isinstance(value, datetime.datetime) for value in uniques])
+        INSTRUMENTATION.count('date_fallbacks', int(fallback[codes + 1].sum()))
+    return pd.Series(formatted[codes + 1], index=df.index, dtype=object)
+
+def _is_truthy(col):
+    """Vectorized truthiness (None, '' and 0 are falsy), as in the `if value:` tests of the row loop."""
+    return col.astype(bool) if len(col) else pd.Series([], index=col.index, dtype=bool)
+
+def build_remarques(conflit, issue, statut):
+    """Concatenates the "Conflit / Issue / Statut Import" remarks column-wise ("" when none)."""
+    remarques = pd.Series("", index=conflit.index, dtype=object)
+    for label, col in [("Conflit", conflit), ("Issue", issue), ("Statut Import", statut)]:
+        present = _is_truthy(col)
+        piece = (f"{label}: " + col.astype(str)).where(present, "")
+        separator = pd.Series(" | ", index=col.index).where(present & (remarques != ""), "")
+        remarques = remarques + separator + piece
+    return remarques
+
+class GestionnaireResolver:
+    """Resolves a "Titulaire" string to a gestionnaire id with in-memory indexes.
+
+    Built once from the gestionnaire list ([{id, prenom, nom, aliases?}]):
+    - exact index on the normalized "prenom nom", "nom prenom", aliases, and prenom or nom
+      alone when they identify a single gestionnaire;
+    - token index (each name token -> ids) for titulaires written with extra words;
+    - trigram index on tokens to find fuzzy candidates (typos) without scanning every name.
+    Results are cached per raw titulaire, so a listing resolves each distinct value once.
+    """
+
+    FUZZY_MIN_RATIO = 0.8
+
+    def __init__(self, gestionnaires):
+        self.exact = {}
+        self.tokens = {}
+        self.trigrams = {}
+        self.cache = {}
+        self.stats = Counter()
+
+        single_keys = Counter()
+        for g in gestionnaires:
+            for part in (normalize_name(g.get('prenom')), normalize_name(g.get('nom'))):
+                if part:
+                    single_keys[part] += 1
+
+        for g in gestionnaires:
+            gestionnaire_id = g['id']
+            prenom, nom = normalize_name(g.get('prenom')), normalize_name(g.get('nom'))
+            keys = {f"{prenom} {nom}".strip(), f"{nom} {prenom}".strip()}
+            keys.update(normalize_name(alias) for alias in g.get('aliases') or [])
+            keys.update(part for part in (prenom, nom) if part and single_keys[part] == 1)
+            for key in keys:
+                if key:
+                    self._add_exact(key, gestionnaire_id)
+            for token in f"{prenom} {nom}".split():
+                self.tokens.setdefault(token, set()).add(gestionnaire_id)
+                for trigram in self._trigrams(token):
+                    self.trigrams.setdefault(trigram, set()).add(token)
+
+    @classmethod
+    def from_json(cls, path):
+        with open(path, encoding='utf-8') as f:
+            return cls(json.load(f))
+
+    def _add_exact(self, key, gestionnaire_id):
+        # Une clé partagée par deux gestionnaires est ambiguë : on ne la résout pas
+        if key in self.exact and self.exact[key] != gestionnaire_id:
+            self.exact[key] = None
+        else:
+            self.exact[key] = gestionnaire_id
+
+    @staticmethod
+    def _trigrams(token):
+        padded = f"  {token} "
+        return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+    def resolve(self, titulaire):
+        """Returns the gestionnaire id for a titulaire, or None when unknown or ambiguous."""
+        if titulaire in self.cache:
+            self.stats['cache_hit'] += 1
+            return self.cache[titulaire]
+        result, path = self._resolve_uncached(normalize_name(titulaire))
+        self.stats[path] += 1
+        self.cache[titulaire] = result
+        return result
+
+    def _resolve_uncached(self, key):
+        if not key:
+            return None, 'empty'
+        if key in self.exact:
+            gestionnaire_id = self.exact[key]
+            return gestionnaire_id, 'exact' if gestionnaire_id else 'ambiguous'
+
+        # Mots exacts : "Louise (remplaçante)" -> tous les mots connus doivent désigner le même gestionnaire
+        candidate_sets = [self.tokens[token] for token in key.split() if token in self.tokens]
+        if candidate_sets:
+            candidates = set.intersection(*candidate_sets)
+            if len(candidates) == 1:
+                return next(iter(candidates)), 'token'
+
+        # Fautes de frappe : chaque mot est rapproché de ses tokens les plus proches (index de trigrammes),
+        # puis, comme pour les mots exacts, les gestionnaires candidats de chaque mot sont intersectés
+        candidate_sets = [ids for ids in map(self._near_token_ids, key.split()) if ids]
+        if not candidate_sets:
+            return None, 'unresolved'
+        candidates = set.intersection(*candidate_sets)
+        if len(candidates) == 1:
+            return next(iter(candidates)), 'fuzzy'
+        return None, 'ambiguous'
 
-    # CHARGEMENT AVEC HEADER=1 (2ème ligne)
+    def _near_token_ids(self, token):
+        """Ids of the gestionnaires having the token, or else the closest tokens above FUZZY_MIN_RATIO."""
+        if token in self.tokens:
+            return self.tokens[token]
+        near_tokens = set()
+        for trigram in self._trigrams(token):
+            near_tokens.update(self.trigrams.get(trigram, ()))
+        best_ids, best_ratio = set(), 0.0
+        for near_token in near_tokens:
+            ratio = difflib.SequenceMatcher(None, token, near_token).ratio()
+            if ratio < self.FUZZY_MIN_RATIO or ratio < best_ratio:
+                continue
+            if ratio > best_ratio:
+                best_ids, best_ratio = set(), ratio
+            best_ids |= self.tokens[near_token]
+        return best_ids
+
+    def unresolved(self):
+        """Distinct titulaires that could not be resolved."""
+        return sorted(str(titulaire) for titulaire, result in self.cache.items() if result is None and titulaire)
+
+def _dossier_number(value):
+    """Normalizes a "N° de dossier" cell: 12, 12.0 and " 12 " all give "12"; blanks give None."""
+    if value is None or pd.isna(value):
+        return None
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).strip() or None
+
+def convert_mediation_dataframe(df, resolver=None, with_dossier=False):
+    """Converts the mediation listing DataFrame into usager records, column by column.
+
+    With a GestionnaireResolver, each record also gets the resolved gestionnaireId. With
+    with_dossier (incremental mode), each record also carries numeroDossier, the listing's
+    "N° de dossier" when the column exists (used as a stable identity between runs).
+    """
+    # Ignorer les lignes sans NOM (souvent des totaux ou lignes vides)
+    keep = pd.Series(False, index=df.index)
+    for name in ('Nom', 'Prénom'):
+        if name in df.columns:
+            keep |= df[name].notna()
+    df = df[keep]
+
+    # 1. Champs de base
+    nom = clean_column(df, 'Nom').tolist()
+    prenom = clean_column(df, 'Prénom').tolist()
+    genre = clean_column(df, 'Genre').tolist()
+    telephone = clean_column(df, 'N°de téléphone').tolist()
+    email = clean_column(df, 'Adresse mail').tolist()
+    tranche_age = clean_column(df, "Tranche d'âge").tolist()
+
+    # 2. Dates (la date de réception remplace une date d'ouverture vide)
+    date_ouverture = format_date_column(df, "Date d'ouverture ")
+    date_reception = format_date_column(df, "Date de reception ")
+    date_ouverture = date_ouverture.where(_is_truthy(date_ouverture), date_reception).tolist()
+    date_cloture = format_date_column(df, "Date de clôture").tolist()
+
+    # 3. Adresse (structure attendue par l'API d'import : userData.adresse = { rue, numero ... })
+    rue_col = clean_column(df, 'Adresse')
+    numero_col = clean_column(df, 'N°')
+    has_rue = _is_truthy(rue_col).tolist()
+    has_numero = _is_truthy(numero_col).tolist()
+    rue = rue_col.tolist()
+    numero = numero_col.astype(str).tolist()
+
+    # 4. Gestionnaire (Titulaire) : le script TS fait le matching fuzzy ; 5. Secteur
+    gestionnaire = clean_column(df, 'Titulaire ').tolist()
+    gestionnaire_id = [resolver.resolve(name) for name in gestionnaire] if resolver else None
+    secteur = clean_column(df, 'Secteur').tolist()
+
+    # 6. Remarques (Type de conflit, issue, statut)
+    remarques = build_remarques(clean_column(df, 'Type de conflit'), clean_column(df, 'Issue'),
+                                clean_column(df, 'Statut')).tolist()
+    dossier = [_dossier_number(value) for value in df[DOSSIER_COLUMN].tolist()] \
+        if with_dossier and DOSSIER_COLUMN in df.columns else None
+
+    users = []
+    for i in range(len(df)):
+        user = {
+            'nom': nom[i],
+            'prenom': prenom[i],
+            'genre': genre[i],
+            'telephone': telephone[i],
+            'email': email[i],
+            'nationalite': None,  # Pas dans le fichier
+            'trancheAge': tranche_age[i],
+            'dateOuverture': date_ouverture[i],
+            'dateCloture': date_cloture[i],
+        }
+        if has_rue[i]:
+            if has_numero[i]:
+                user['adresse'] = {'rue': rue[i], 'numero': numero[i], 'ville': DEFAULT_VILLE, 'codePostal': DEFAULT_CODE_POSTAL}
+            else:
+                user['adresse'] = {'rue': rue[i], 'ville': DEFAULT_VILLE, 'codePostal': DEFAULT_CODE_POSTAL}
+        user['gestionnaire'] = gestionnaire[i]
+        if gestionnaire_id is not None:
+            user['gestionnaireId'] = gestionnaire_id[i]
+        user['secteur'] = secteur[i]
+        if remarques[i]:
+            user['remarques'] = remarques[i]
+        if dossier is not None:
+            user['numeroDossier'] = dossier[i]
+        # 7. Année (Fixée à 2025 comme demandé par le nom du fichier)
+        user['annee'] = IMPORT_YEAR
+        users.append(user)
+    return users
+
+# Lecture en flux (--streaming) : nombre de lignes converties à la fois
+STREAM_BATCH_SIZE = 2000
+def _iter_sheet_rows(workbook, width):
+    """Yields the normalized data rows (after the header) of the first sheet, truncated to width."""
+    rows = workbook.worksheets[0].iter_rows(min_row=HEADER_ROW + 1, values_only=True)
+    for row in rows:
+        yield [normalize_cell(value) for value in row[:width]]
+
+def _scan_numeric_columns(input_path, width):
+    """Returns {column index: float or int} for the columns read_excel would infer as numeric.
+
+    pandas counts booleans as numbers: a column holding only numbers and booleans becomes
+    float64 as soon as it has a blank (including the cells of an empty row followed by more
+    data) or a non-integral value, int64 otherwise (unless it only holds booleans). Its
+    values are then written 2.0 / 1.0 rather than 2 / True. This needs the whole column,
+    hence a first read-only pass.
+    """
+    numeric = [True] * width
+    has_number = [False] * width
+    has_blank = [False] * width
+    has_fraction = [False] * width
+    pending_empty_row = False
+    workbook = openpyxl.load_workbook(input_path, read_only=True, data_only=True)
     try:
-        df = pd.read_excel(input_path, header=1)
+        for values in _iter_sheet_rows(workbook, width):
+            values.extend([None] * (width - len(values)))
+            if not any(value is not None for value in values):
+                pending_empty_row = True  # compte seulement si d'autres lignes suivent (pandas retire la fin vide)
+                continue
+            if pending_empty_row:
+                has_blank = [True] * width
+                pending_empty_row = False
+            for i, value in enumerate(values):
+                if value is None:
+                    has_blank[i] = True
+                elif not isinstance(value, (bool, int, float)):
+                    numeric[i] = False
+                elif not isinstance(value, bool):
+                    has_number[i] = True
+                    if isinstance(value, float):
+                        has_fraction[i] = True
+    finally:
+        workbook.close()
+    kinds = {}
+    for i in range(width):
+        if numeric[i] and (has_blank[i] or has_fraction[i]):
+            kinds[i] = float
+        elif numeric[i] and has_number[i]:
+            kinds[i] = int
+    return kinds
+
+def iter_mediation_batches(input_path, batch_size=STREAM_BATCH_SIZE):
+    """Reads the first sheet in read-only mode and yields DataFrames of at most batch_size rows.
+
+    Columns are kept as object dtype so that each batch converts exactly like the others,
+    whatever values it happens to contain; the values of the columns pandas would read as
+    numeric are converted to float or int, as read_excel does (see _scan_numeric_columns).
+    """
+    workbook = openpyxl.load_workbook(input_path, read_only=True, data_only=True)
+    try:
+        header_rows = workbook.worksheets[0].iter_rows(min_row=HEADER_ROW, max_row=HEADER_ROW, values_only=True)
+        headers = dedupe_headers(next(header_rows, ()))
+        width = len(headers)
+        numeric_columns = _scan_numeric_columns(input_path, width).items()
+
+        batch = []
+        for values in _iter_sheet_rows(workbook, width):
+            if not any(value is not None for value in values):
+                continue  # ligne vide
+            values.extend([None] * (width - len(values)))
+            for i, kind in numeric_columns:
+                if values[i] is not None:
+                    values[i] = kind(values[i])
+            batch.append(values)
+            if len(batch) >= batch_size:
+                yield pd.DataFrame(batch, columns=headers, dtype=object)
+                batch = []
+        if batch:
+            yield pd.DataFrame(batch, columns=headers, dtype=object)
+    finally:
+        workbook.close()
+
+def iter_mediation_records(input_path, batch_size=STREAM_BATCH_SIZE, resolver=None, with_dossier=False):
+    """Yields converted usager records batch by batch, with constant memory."""
+    convert = INSTRUMENTATION.timed('conversion', convert_mediation_dataframe)
+    for batch in INSTRUMENTATION.timed_iter('excel_read', iter_mediation_batches(input_path, batch_size)):
+        yield from convert(batch, resolver, with_dossier)
+
+OUTPUT_FORMATS = ['json', 'compact', 'ndjson']
+# NDJSON : nombre d'enregistrements écrits entre deux flush (visibles côté TypeScript quand la sortie est stdout)
+NDJSON_FLUSH_EVERY = 500
+
+def write_records(records, output_path, output_format='json', flush_every=NDJSON_FLUSH_EVERY):
+    """Writes records as they come and returns the count.
+
+    json: same layout as json.dump(records, indent=2); compact: one-line JSON array;
+    ndjson: one compact record per line, flushed every flush_every records so that a reader of
+    stdout (run_mediation_import.ts -) can insert batches while the conversion is still running.
+    output_path "-" means stdout.
+    A file is written under a temporary name and only renamed to output_path once complete,
+    so a failed conversion never leaves an empty or truncated output behind.
+    """
+    temp_path = None if output_path == '-' else output_path + '.tmp'
+    out = sys.stdout if temp_path is None else open(temp_path, 'w', encoding='utf-8')
+    count = 0
+    completed = False
+    try:
+        for record in records:
+            if output_format == 'ndjson':
+                out.write(json.dumps(record, ensure_ascii=False, separators=(',', ':')) + "\n")
+                if (count + 1) % flush_every == 0:
+                    out.flush()
+            elif output_format == 'compact':
+                out.write("," if count else "[")
+                out.write(json.dumps(record, ensure_ascii=False, separators=(',', ':')))
+            else:
+                out.write(",\n  " if count else "[\n  ")
+                out.write(json.dumps(record, ensure_ascii=False, indent=2).replace("\n", "\n  "))
+            count += 1
+        if output_format == 'compact':
+            out.write("]" if count else "[]")
+        elif output_format == 'json':
+            out.write("\n]" if count else "[]")
+        out.flush()
+        completed = True
+    finally:
+        if out is not sys.stdout:
+            out.close()
+            if completed:
+                os.replace(temp_path, output_path)
+            else:
+                os.remove(temp_path)
+    return count
+
+class IncrementalImportState:
+    """Change detection between runs, based on a local state file of record fingerprints.
+
+    Each record is identified by the listing's "N° de dossier" when it has one (stable when
+    rows are inserted or reordered), otherwise by its normalized nom|prénom, with a #n suffix
+    for repeats in listing order. It is fingerprinted with a SHA-1 of its canonical JSON, i.e.
+    all the converted fields: dates, adresse, titulaire, remarques... filter() only lets new
+    or changed records through, tagged with importKey / importStatus; removed() lists the
+    keys seen in the previous run but not in this one.
+
+    save() writes the new fingerprints next to the state file (<state>.pending): they only
+    replace it once the records have actually been imported (run_mediation_import.ts --state),
+    so a failed import is detected again on the next run.
+    """
+
+    STATE_VERSION = 2
+
+    def __init__(self, state_path):
+        self.state_path = state_path
+        self.pending_path = state_path + '.pending'
+        self.previous = {}
+        if os.path.exists(state_path):
+            with open(state_path, encoding='utf-8') as f:
+                state = json.load(f)
+            if state.get('version') == self.STATE_VERSION:
+                self.previous = state.get('records', {})
+            else:
+                # Clés de l'ancienne version (nom|prénom seulement) : on repart d'un état vide
+                print(f"⚠️ État incrémental {state_path} d'une version antérieure ignoré", file=sys.stderr)
+        self.current = {}
+        self.counts = Counter()
+        self._occurrences = Counter()
+
+    def record_key(self, record):
+        dossier = record.get('numeroDossier')
+        if dossier:
+            base_key = f"dossier:{dossier}"
+        else:
+            base_key = f"{normalize_name(record.get('nom'))}|{normalize_name(record.get('prenom'))}"
+        self._occurrences[base_key] += 1
+        occurrence = self._occurrences[base_key]
+        return base_key if occurrence == 1 else f"{base_key}#{occurrence}"
+
+    @staticmethod
+    def fingerprint(record):
+        canonical = json.dumps(record, ensure_ascii=False, sort_keys=True, separators=(',', ':'), default=str)
+        return hashlib.sha1(canonical.encode('utf-8')).hexdigest()
+
+    def filter(self, records):
+        for record in records:
+            key = self.record_key(record)
+            fingerprint = self.fingerprint(record)
+            self.current[key] = fingerprint
+            previous_fingerprint = self.previous.get(key)
+            if previous_fingerprint == fingerprint:
+                self.counts['unchanged'] += 1
+                continue
+            status = 'new' if previous_fingerprint is None else 'changed'
+            self.counts[status] += 1
+            yield {**record, 'importKey': key, 'importStatus': status}
+
+    def removed(self):
+        return sorted(self.previous.keys() - self.current.keys())
+
+    def save(self, source=None):
+        """Writes the fingerprints of this run to the pending state file (atomic rename)."""
+        temp_path = self.pending_path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': self.STATE_VERSION, 'source': source, 'records': self.current}, f)
+        os.replace(temp_path, self.pending_path)
+
+def _print_resolver_report(resolver, log):
+    if resolver is None:
+        return
+    unresolved = resolver.unresolved()
+    print(f"👤 Gestionnaires résolus : {len(resolver.cache) - len(unresolved)} titulaires distincts"
+          f" ({dict(resolver.stats)})", file=log)
+    if unresolved:
+        print(f"⚠️ Titulaires non résolus : {', '.join(unresolved)}", file=log)
+
+def process_mediation_file(input_path, output_path, streaming=False, output_format='json',
+                           flush_every=NDJSON_FLUSH_EVERY, resolver=None, state_path=None, removed_path=None):
+    # Quand la sortie est stdout ("-"), les messages de progression passent sur stderr
+    log = sys.stderr if output_path == '-' else sys.stdout
+    print(f"🔄 Traitement du fichier : {input_path}", file=log)
+
+    try:
+        if streaming:
+            # Lecture ligne à ligne (openpyxl read-only) et écriture au fil de la conversion
+            records = iter_mediation_records(input_path, resolver=resolver, with_dossier=bool(state_path))
+        else:
+            # CHARGEMENT AVEC HEADER=1 (2ème ligne)
+            with INSTRUMENTATION.phase('excel_read'):
+                df = pd.read_excel(input_path, header=1)
+            with INSTRUMENTATION.phase('conversion'):
+                records = convert_mediation_dataframe(df, resolver, with_dossier=bool(state_path))
+            print(f"✅ Conversion terminée : {len(records)} usagers extraits.", file=log)
+
+        # Mode incrémental : seuls les usagers nouveaux ou modifiés depuis le dernier passage sont écrits
+        import_state = IncrementalImportState(state_path) if state_path else None
+        if import_state:
+            records = import_state.filter(records)
+
+        with INSTRUMENTATION.phase('dump'):
+            count = write_records(records, output_path, output_format, flush_every)
+        INSTRUMENTATION.count('records', count)
     except Exception as e:
-        print(f"❌ Erreur de lecture : {e}")
+        print(f"❌ Erreur de lecture : {e}", file=log)
         sys.exit(1)
 
-    users = []
+    if streaming:
+        print(f"✅ Conversion terminée : {count} usagers extraits.", file=log)
+    _print_resolver_report(resolver, log)
+    print(f"💾 Fichier JSON sauvegardé : {output_path}", file=log)
 
-    for _, row in df.iterrows():
-        # Ignorer les lignes sans NOM (souvent des totaux ou lignes vides)
-        if pd.isna(row.get('Nom')) and pd.isna(row.get('Prénom')):
-            continue
-
-        user = {}
-
-        # 1. Champs de base
-        user['nom'] = clean_value(row.get('Nom'))
-        user['prenom'] = clean_value(row.get('Prénom'))
-        user['genre'] = clean_value(row.get('Genre'))
-        user['telephone'] = clean_value(row.get('N°de téléphone'))
-        user['email'] = clean_value(row.get('Adresse mail'))
-        user['nationalite'] = None # Pas dans le fichier
-        user['trancheAge'] = clean_value(row.get("Tranche d'âge"))
-
-        # 2. Dates
-        user['dateOuverture'] = format_date(row.get("Date d'ouverture "))
-        user['dateCloture'] = format_date(row.get("Date de clôture"))
-        # Date de réception -> Peut servir si ouverture est vide ?
-        if not user['dateOuverture']:
-            user['dateOuverture'] = format_date(row.get("Date de reception "))
-
-        # 3. Adresse (Concatenation)
-        rue = clean_value(row.get('Adresse'))
-        numero = clean_value(row.get('N°'))
-
-        if rue:
-            full_address_str = rue
-            if numero:
-                # Si le numéro est déjà dans la rue (ex: "Rue X 12"), on évite de le remettre ?
-                # Sauf que "Adresse" semble être juste la rue ici.
-                # On passe un objet adresse structuré car l'API d'import supporte userData.adresse = { rue, numero ... }
-                # MAIS l'API d'import actuelle regarde userData.adresse pour créer une entité Adresse.
-                # C'est mieux d'envoyer la structure.
-                user['adresse'] = {
-                    'rue': rue,
-                    'numero': str(numero) if numero else None,
-                    'ville': 'Anderlecht', # Hypothèse raisonnable pour PASQ/Médiation ? Ou laisser null.
-                    'codePostal': '1070'
-                }
-            else:
-                 user['adresse'] = { 'rue': rue, 'ville': 'Anderlecht', 'codePostal': '1070' }
+    if import_state:
+        removed = import_state.removed()
+        if removed_path is None and output_path != '-':
+            removed_path = os.path.splitext(output_path)[0] + '.removed.json'
+        if removed_path:
+            with open(removed_path, 'w', encoding='utf-8') as f:
+                json.dump(removed, f, ensure_ascii=False, indent=2)
+        import_state.save(source=os.path.basename(input_path))
+        print(f"🔁 Incrémental : {import_state.counts['new']} nouveaux, {import_state.counts['changed']} modifiés, "
+              f"{import_state.counts['unchanged']} inchangés, {len(removed)} disparus"
+              + (f" (liste : {removed_path})" if removed_path else ""), file=log)
+        print(f"⏳ Nouvel état en attente : {import_state.pending_path} "
+              f"(remplace {state_path} après l'import : run_mediation_import.ts --state {state_path})", file=log)
 
-        # 4. Gestionnaire (Titulaire)
-        # L'API s'attend à "gestionnaire" (nom ou ID). Le script TS fait déjà le matching fuzzy.
-        user['gestionnaire'] = clean_value(row.get('Titulaire '))
+OUTPUT_EXTENSIONS = {'json': '.json', 'compact': '.json', 'ndjson': '.ndjson'}
+MERGED_OUTPUT_NAME = 'merged.ndjson'
 
-        # 5. Secteur
-        user['secteur'] = clean_value(row.get('Secteur'))
+def resolve_batch_inputs(pattern):
+    """Returns the workbooks of a directory (*.xlsx) or matching a glob, sorted, without Excel lock files."""
+    if os.path.isdir(pattern):
+        pattern = os.path.join(pattern, '*.xlsx')
+    return sorted(path for path in glob.glob(pattern) if not os.path.basename(path).startswith('~$'))
 
-        # 6. Champs spécifiques / Remarques
-        # On peut mettre Type de conflit, issue, statut dans les remarques ou champs JSON ?
-        type_conflit = clean_value(row.get('Type de conflit'))
-        issue = clean_value(row.get('Issue'))
-        statut = clean_value(row.get('Statut'))
+def convert_file(input_path, output_path, streaming=False, output_format='json', resolver=None, metrics=False):
+    """Pool task: converts one workbook without printing and returns its report (rows, seconds, error).
+
+    With metrics, the report also carries the file's instrumentation summary.
+    """
+    started = time.perf_counter()
+    instrumentation = Instrumentation(enabled=metrics)
+    try:
+        with instrumented_run(instrumentation):
+            if streaming:
+                records = iter_mediation_records(input_path, resolver=resolver)
+            else:
+                with INSTRUMENTATION.phase('excel_read'):
+                    df = pd.read_excel(input_path, header=1)
+                with INSTRUMENTATION.phase('conversion'):
+                    records = convert_mediation_dataframe(df, resolver)
+            with INSTRUMENTATION.phase('dump'):
+                count = write_records(records, output_path, output_format)
+        report = {'input': input_path, 'output': output_path, 'rows': count,
+                  'seconds': round(time.perf_counter() - started, 3), 'error': None}
+        if metrics:
+            report['metrics'] = instrumentation.summary()
+        return report
+    except Exception as e:
+        # Pas de sortie partielle pour un classeur en erreur
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        return {'input': input_path, 'output': output_path, 'rows': 0,
+                'seconds': round(time.perf_counter() - started, 3), 'error': str(e)}
 
-        remarques = []
-        if type_conflit: remarques.append(f"Conflit: {type_conflit}")
-        if issue: remarques.append(f"Issue: {issue}")
-        if statut: remarques.append(f"Statut Import: {statut}")
+def _iter_output_records(output_path, output_format):
+    if output_format == 'ndjson':
+        with open(output_path, encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+    else:
+        with open(output_path, encoding='utf-8') as f:
+            yield from json.load(f)
 
-        if remarques:
-            user['remarques'] = " | ".join(remarques)
+def process_mediation_batch(pattern, output_dir, workers=None, streaming=False, output_format='json',
+                            resolver=None, metrics=False):
+    """Converts several workbooks concurrently: one output per file plus a merged NDJSON stream.
 
-        # 7. Année (Fixée à 2025 comme demandé par le nom du fichier)
-        user['annee'] = 2025
+    With metrics, each file's report carries its own instrumentation summary (see convert_file).
+    """
+    input_paths = resolve_batch_inputs(pattern)
+    if not input_paths:
+        print(f"❌ Aucun classeur trouvé pour : {pattern}")
+        sys.exit(1)
 
-        users.append(user)
+    os.makedirs(output_dir, exist_ok=True)
+    extension = OUTPUT_EXTENSIONS[output_format]
+    merged_path = os.path.join(output_dir, MERGED_OUTPUT_NAME)
+    output_paths = []
+    for input_path in input_paths:
+        stem = os.path.splitext(os.path.basename(input_path))[0]
+        candidate, suffix = os.path.join(output_dir, stem + extension), 2
+        # Deux classeurs de même nom dans des dossiers différents ne doivent pas s'écraser,
+        # ni un classeur « merged.xlsx » être écrasé par le flux fusionné
+        while candidate in output_paths or candidate == merged_path:
+            candidate = os.path.join(output_dir, f"{stem}_{suffix}{extension}")
+            suffix += 1
+        output_paths.append(candidate)
 
-    print(f"✅ Conversion terminée : {len(users)} usagers extraits.")
+    print(f"🔄 Traitement de {len(input_paths)} classeurs ({workers or os.cpu_count()} processus)...")
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(convert_file, input_path, output_path, streaming, output_format, resolver, metrics)
+                   for input_path, output_path in zip(input_paths, output_paths)]
+        for future in as_completed(futures):
+            report = future.result()
+            status = f"❌ {report['error']}" if report['error'] else f"✅ {report['rows']} usagers"
+            print(f"   {os.path.basename(report['input'])} : {status}")
+        reports = [future.result() for future in futures]
 
-    # Export JSON
-    with open(output_path, 'w', encoding='utf-8') as f:
-        json.dump(users, f, ensure_ascii=False, indent=2)
+    # Flux fusionné, dans l'ordre des fichiers d'entrée
+    with INSTRUMENTATION.phase('merge'):
+        merged_count = write_records(
+            (record for report in reports if not report['error']
+             for record in _iter_output_records(report['output'], output_format)),
+            merged_path, 'ndjson')
 
-    print(f"💾 Fichier JSON sauvegardé : {output_path}")
+    print("\n📊 Rapport :")
+    for report in reports:
+        status = f"ERREUR : {report['error']}" if report['error'] else f"{report['rows']:>7} usagers"
+        print(f"   - {os.path.basename(report['input'])} : {status} en {report['seconds']:.2f}s")
+    print(f"✅ Total : {merged_count} usagers, {len(input_paths)} fichiers, {time.perf_counter() - started:.2f}s")
+    print(f"💾 Flux fusionné : {merged_path}")
+    return reports
 
 if __name__ == "__main__":
-    if len(sys.argv) < 3:
-        print("Usage: python process_mediation_import.py <input_xlsx> <output_json>")
-        sys.exit(1)
+    arg_parser = argparse.ArgumentParser(description="Conversion du listing Médiation (Excel) en JSON d'import")
+    arg_parser.add_argument("input_xlsx", help="Classeur à convertir (avec --batch : dossier ou motif glob)")
+    arg_parser.add_argument("output_json", help='Fichier de sortie ("-" pour stdout ; avec --batch : dossier de sortie)')
+    arg_parser.add_argument("--gestionnaires", metavar="JSON",
+                            help="Liste des gestionnaires [{id, prenom, nom, aliases?}] pour résoudre gestionnaireId")
+    arg_parser.add_argument("--state", metavar="JSON",
+                            help="Mode incrémental : fichier d'état des empreintes, seuls les usagers nouveaux/modifiés sont écrits "
+                                 "(le nouvel état, <state>.pending, est validé par run_mediation_import.ts --state)")
+    arg_parser.add_argument("--removed", metavar="JSON",
+                            help="Avec --state, fichier des usagers disparus (par défaut : <sortie>.removed.json)")
+    arg_parser.add_argument("--batch", action="store_true",
+                            help="Convertit plusieurs classeurs en parallèle (un fichier par classeur + merged.ndjson)")
+    arg_parser.add_argument("--workers", type=int, default=None,
+                            help="Avec --batch, nombre de processus (par défaut : nombre de CPU)")
+    arg_parser.add_argument("--streaming", action="store_true",
+                            help="Lecture en flux (openpyxl read-only) et écriture du JSON au fil de l'eau")
+    arg_parser.add_argument("--format", choices=OUTPUT_FORMATS, default='json',
+                            help="json (indenté, par défaut), compact (une ligne) ou ndjson (un usager par ligne)")
+    arg_parser.add_argument("--flush-every", type=int, default=NDJSON_FLUSH_EVERY,
+                            help="En ndjson, nombre d'usagers écrits entre deux flush")
+    arg_parser.add_argument("--metrics", metavar="PATH",
+                            help='Écrit un résumé JSON (durée par phase, compteurs, mémoire de pointe) ; "-" pour stderr')
+    arg_parser.add_argument("--profile-out", metavar="PATH",
+                            help="Enregistre un profil cProfile de la conversion (lisible avec pstats / snakeviz)")
+    args = arg_parser.parse_args()
+
+    gestionnaire_resolver = GestionnaireResolver.from_json(args.gestionnaires) if args.gestionnaires else None
+
+    if args.batch and args.state:
+        arg_parser.error("--state is not supported with --batch (one state file per workbook)")
+    if args.flush_every < 1:
+        arg_parser.error("--flush-every must be at least 1")
+
+    run_instrumentation = Instrumentation(enabled=bool(args.metrics or args.profile_out), profile_path=args.profile_out)
+
+    if args.batch:
+        with instrumented_run(run_instrumentation):
+            batch_reports = process_mediation_batch(args.input_xlsx, args.output_json, workers=args.workers,
+                                                    streaming=args.streaming, output_format=args.format,
+                                                    resolver=gestionnaire_resolver,
+                                                    metrics=run_instrumentation.enabled)
+        if run_instrumentation.enabled:
+            run_instrumentation.write_summary(args.metrics or '-', script='process_mediation_import', batch=True,
+                                              files=[{'input': report['input'], 'error': report['error'],
+                                                      **report.get('metrics', {})} for report in batch_reports])
+        sys.exit(1 if any(report['error'] for report in batch_reports) else 0)
 
-    process_mediation_file(sys.argv[1], sys.argv[2])
+    with instrumented_run(run_instrumentation):
+        process_mediation_file(args.input_xlsx, args.output_json, streaming=args.streaming,
+                               output_format=args.format, flush_every=args.flush_every,
+                               resolver=gestionnaire_resolver, state_path=args.state, removed_path=args.removed)
+    if run_instrumentation.enabled:
+        extra = {'resolver': dict(gestionnaire_resolver.stats)} if gestionnaire_resolver else {}
+        run_instrumentation.write_summary(args.metrics or '-', script='process_mediation_import', **extra)
@@ -1,14 +1,51 @@
 import { PrismaClient } from '@prisma/client';
 import * as fs from 'fs';
 import * as path from 'path';
-import { randomUUID } from 'crypto';
+import * as readline from 'readline';
+import { createHash, randomUUID } from 'crypto';
 
 const prisma = new PrismaClient();
 
+/**
+ * Lit les usagers produits par process_mediation_import.py.
+ * - "-" : NDJSON sur stdin, inséré pendant que Python convertit encore le classeur
+ *   (python3 process_mediation_import.py listing.xlsx - --streaming --format ndjson | npx tsx run_mediation_import.ts -)
+ * - .ndjson (--format ndjson) : un usager par ligne, lu et inséré au fil de l'eau sans charger tout le fichier
+ * - sinon : tableau JSON chargé en une fois
+ */
+async function* readImportedUsers(filePath: string): AsyncGenerator<any> {
+    if (filePath === '-' || filePath.endsWith('.ndjson')) {
+        const input = filePath === '-' ? process.stdin : fs.createReadStream(filePath, 'utf-8');
+        const lines = readline.createInterface({ input, crlfDelay: Infinity });
+        for await (const line of lines) {
+            if (line.trim()) yield JSON.parse(line);
+        }
+        return;
+    }
+    const users = JSON.parse(fs.readFileSync(filePath, 'utf-8'));
+    console.log(`📂 Fichier JSON chargé : ${users.length} utilisateurs à importer.`);
+    yield* users;
+}
+
+/**
+ * Id stable d'un usager du mode incrémental (--state côté Python) : dérivé de son importKey,
+ * pour qu'un usager "changed" mette à jour la fiche créée lors d'un import précédent.
+ */
+function importUserId(serviceId: string, annee: number, importKey: string): string {
+    const hex = createHash('sha1').update(`${serviceId}:${annee}:${importKey}`).digest('hex');
+    return `${hex.slice(0, 8)}-${hex.slice(8, 12)}-5${hex.slice(13, 16)}-8${hex.slice(17, 20)}-${hex.slice(20, 32)}`;
+}
+
 async function main() {
     const SERVICE_ID = 'mediation';
     const SERVICE_NAME = 'Médiation Locale';
-    const JSON_FILE = path.join(process.cwd(), 'public', 'import_mediation_ready.json');
+    const args = process.argv.slice(2);
+    // --state <fichier> : état incrémental de process_mediation_import.py, validé (<state>.pending) si l'import réussit
+    const stateIndex = args.indexOf('--state');
+    const STATE_FILE = stateIndex >= 0 ? args.splice(stateIndex, 2)[1] : null;
+    // Fichier produit par process_mediation_import.py (JSON ou NDJSON, "-" pour stdin), passé en argument ou par défaut
+    const JSON_FILE = args[0] || path.join(process.cwd(), 'public', 'import_mediation_ready.json');
+    const ANNEE = 2025;
 
     console.log(`🚀 Démarrage de l'import pour le service : ${SERVICE_NAME} (${SERVICE_ID})`);
 
@@ -86,24 +123,23 @@ async function main() {
     }
 
     // 3. Lire le JSON
-    if (!fs.existsSync(JSON_FILE)) {
+    if (JSON_FILE !== '-' && !fs.existsSync(JSON_FILE)) {
         console.error(`❌ Fichier introuvable : ${JSON_FILE}`);
         process.exit(1);
     }
 
-    const rawData = fs.readFileSync(JSON_FILE, 'utf-8');
-    const users = JSON.parse(rawData);
-    console.log(`📂 Fichier JSON chargé : ${users.length} utilisateurs à importer.`);
-
     // 4. Importer les utilisateurs
     let successCount = 0;
     let errorCount = 0;
 
-    for (const userData of users) {
+    for await (const userData of readImportedUsers(JSON_FILE)) {
         try {
             // a. Gestion du Gestionnaire
             let gestionnaireId = null;
-            if (userData.gestionnaire) {
+            if (userData.gestionnaireId) {
+                // Déjà résolu côté Python (process_mediation_import.py --gestionnaires)
+                gestionnaireId = userData.gestionnaireId;
+            } else if (userData.gestionnaire) {
                 const gestName = userData.gestionnaire.trim();
 
                 if (gestionnaireCache[gestName]) {
@@ -139,45 +175,68 @@ async function main() {
                 }
             }
 
-            // b. Gestion de l'Adresse
+            // b. Usager du mode incrémental : id stable, on met à jour la fiche existante au lieu d'en créer une autre
+            const userId = userData.importKey ? importUserId(SERVICE_ID, ANNEE, userData.importKey) : randomUUID();
+            const existingUser = userData.importKey
+                ? await prisma.user.findUnique({ where: { id: userId }, select: { adresseId: true } })
+                : null;
+
+            // c. Gestion de l'Adresse
             let adresseId = null;
             if (userData.adresse && userData.adresse.rue) {
-                const newAddr = await prisma.adresse.create({
+                const adresseData = {
+                    rue: userData.adresse.rue,
+                    numero: userData.adresse.numero,
+                    codePostal: userData.adresse.codePostal,
+                    ville: userData.adresse.ville
+                };
+                const addr = existingUser?.adresseId
+                    ? await prisma.adresse.update({ where: { id: existingUser.adresseId }, data: adresseData })
+                    : await prisma.adresse.create({ data: adresseData });
+                adresseId = addr.id;
+            }
+
+            const userFields = {
+                nom: userData.nom || "Inconnu",
+                prenom: userData.prenom || "Inconnu",
+                // Dates
+                dateOuverture: userData.dateOuverture ? new Date(userData.dateOuverture) : new Date(),
+                dateCloture: userData.dateCloture ? new Date(userData.dateCloture) : null,
+                // Contact
+                telephone: userData.telephone,
+                email: userData.email,
+                // Infos
+                genre: userData.genre,
+                trancheAge: userData.trancheAge,
+                secteur: userData.secteur,
+                remarques: userData.remarques,
+                annee: ANNEE,
+            };
+
+            if (existingUser) {
+                // d. Mise à jour de l'User (usager "changed" déjà importé)
+                await prisma.user.update({
+                    where: { id: userId },
                     data: {
-                        rue: userData.adresse.rue,
-                        numero: userData.adresse.numero,
-                        codePostal: userData.adresse.codePostal,
-                        ville: userData.adresse.ville
+                        ...userFields,
+                        adresse: adresseId ? { connect: { id: adresseId } } : { disconnect: true },
+                        gestionnaire: gestionnaireId ? { connect: { id: gestionnaireId } } : { disconnect: true }
                     }
                 });
-                adresseId = newAddr.id;
-            }
+            } else {
+                // d. Création de l'User
+                await prisma.user.create({
+                    data: {
+                        id: userId,
+                        service: { connect: { id: SERVICE_ID } },
+                        ...userFields,
 
-            // c. Création de l'User
-            await prisma.user.create({
-                data: {
-                    id: randomUUID(),
-                    service: { connect: { id: SERVICE_ID } },
-                    nom: userData.nom || "Inconnu",
-                    prenom: userData.prenom || "Inconnu",
-                    // Dates
-                    dateOuverture: userData.dateOuverture ? new Date(userData.dateOuverture) : new Date(),
-                    dateCloture: userData.dateCloture ? new Date(userData.dateCloture) : null,
-                    // Contact
-                    telephone: userData.telephone,
-                    email: userData.email,
-                    // Infos
-                    genre: userData.genre,
-                    trancheAge: userData.trancheAge,
-                    secteur: userData.secteur,
-                    remarques: userData.remarques,
-                    annee: 2025,
-
-                    // Relations
-                    ...(adresseId && { adresse: { connect: { id: adresseId } } }),
-                    ...(gestionnaireId && { gestionnaire: { connect: { id: gestionnaireId } } })
-                }
-            });
+                        // Relations
+                        ...(adresseId && { adresse: { connect: { id: adresseId } } }),
+                        ...(gestionnaireId && { gestionnaire: { connect: { id: gestionnaireId } } })
+                    }
+                });
+            }
 
             process.stdout.write('.'); // Feedback visuel
             successCount++;
@@ -192,6 +251,19 @@ async function main() {
     console.log(`Succès : ${successCount}`);
     console.log(`Erreurs : ${errorCount}`);
     console.log(`Service ID : ${SERVICE_ID}`);
+
+    // 5. Valider l'état incrémental seulement si tous les usagers ont été importés
+    if (STATE_FILE) {
+        const pendingState = `${STATE_FILE}.pending`;
+        if (errorCount === 0 && fs.existsSync(pendingState)) {
+            fs.renameSync(pendingState, STATE_FILE);
+            console.log(`🔁 État incrémental validé : ${STATE_FILE}`);
+        } else if (errorCount > 0) {
+            console.warn(`⚠️ État incrémental non validé (${errorCount} erreurs) : les usagers seront reproposés au prochain passage`);
+        } else {
+            console.warn(`⚠️ Aucun état en attente : ${pendingState}`);
+        }
+    }
 }
 
 main()